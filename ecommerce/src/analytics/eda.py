@@ -1,7 +1,16 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import numpy as np
 import pandas as pd
 import sqlite3
+import time
 import matplotlib.pyplot as plt
 import seaborn as sns
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # 改用其中一個可用的 seaborn 風格
@@ -9,192 +18,644 @@ plt.style.use('seaborn-v0_8')  # 或是使用 'seaborn-darkgrid'
 plt.rcParams['font.sans-serif'] = ['Arial Unicode MS']
 plt.rcParams['axes.unicode_minus'] = False
 
+# 資料庫以 ISO 8601 字串儲存日期，載入時依固定格式一次轉換
+DATE_COLUMNS = {column: {'format': 'ISO8601'} for column in ['created_at', 'order_date', 'customer_since']}
+
+# 低基數的字串欄位以 category dtype 載入
+CATEGORY_COLUMNS = {'status', 'payment_method', 'category_name'}
+
+PRICE_BINS = [0, 500, 1000, 5000, 10000, float('inf')]
+PRICE_LABELS = ['0-500', '501-1000', '1001-5000', '5001-10000', '10000+']
+
+# 與 load_data 相同的 JOIN 範圍，讓 SQL 與 pandas 兩種算法的結果一致
+ORDERS_FROM = "FROM orders o JOIN customers c ON o.customer_id = c.customer_id"
+ORDER_ITEMS_FROM = """FROM order_items oi
+            JOIN products p ON oi.product_id = p.product_id
+            JOIN categories c ON p.category_id = c.category_id
+            LEFT JOIN orders o ON oi.order_id = o.order_id"""
+
+# 延遲載入的資料集：(資料表別名, FROM 子句, 列鍵值)，非本表的欄位另列運算式
+DATASETS = {
+    'orders': ('o', ORDERS_FROM, 'order_id'),
+    'order_items': ('oi', ORDER_ITEMS_FROM, 'order_item_id')
+}
+COLUMN_EXPRESSIONS = {
+    'orders': {'customer_since': 'c.customer_since'},
+    'order_items': {'sku': 'p.sku', 'category_name': 'c.name', 'increment_id': 'o.increment_id'}
+}
+
+# push-down 模式：在 SQLite 中完成 GROUP BY，只取回彙總後的小表
+PUSHDOWN_QUERIES = {
+    'sales_trends': f"""
+        SELECT o.order_date, SUM(o.grand_total) AS grand_total
+        {ORDERS_FROM}
+        WHERE o.order_date IS NOT NULL
+        GROUP BY o.order_date
+        ORDER BY o.order_date
+    """,
+    'category_distribution': f"""
+        SELECT c.name AS category_name, SUM(oi.qty_ordered) AS qty_ordered, SUM(oi.line_total) AS revenue
+        {ORDER_ITEMS_FROM}
+        GROUP BY c.name
+    """,
+    'payment_methods': f"""
+        SELECT o.payment_method, COUNT(*) AS count
+        {ORDERS_FROM}
+        WHERE o.payment_method IS NOT NULL
+        GROUP BY o.payment_method
+        ORDER BY count DESC
+    """,
+    'order_status': f"""
+        SELECT o.status, COUNT(*) AS count
+        {ORDERS_FROM}
+        GROUP BY o.status
+        ORDER BY count DESC
+    """,
+    'hourly_patterns': f"""
+        SELECT o.order_hour, COUNT(*) AS count
+        {ORDERS_FROM}
+        WHERE o.order_hour IS NOT NULL
+        GROUP BY o.order_hour
+        ORDER BY o.order_hour
+    """,
+    'price_distribution': f"""
+        SELECT CASE
+                   WHEN oi.price <= 500 THEN '0-500'
+                   WHEN oi.price <= 1000 THEN '501-1000'
+                   WHEN oi.price <= 5000 THEN '1001-5000'
+                   WHEN oi.price <= 10000 THEN '5001-10000'
+                   ELSE '10000+'
+               END AS price_range,
+               COUNT(*) AS count
+        {ORDER_ITEMS_FROM}
+        WHERE oi.price > 0
+        GROUP BY price_range
+    """,
+    'customer_behavior': f"""
+        SELECT o.customer_id,
+               COUNT(o.order_id) AS order_count,
+               TOTAL(o.grand_total) AS total_spent,
+               AVG(o.grand_total) AS avg_order_value,
+               (strftime('%s', MAX(o.created_at)) - strftime('%s', MIN(o.created_at))) / 86400 AS days_active
+        {ORDERS_FROM}
+        GROUP BY o.customer_id
+    """,
+    'category_correlations': f"""
+        SELECT o.increment_id, c.name AS category_name, COUNT(*) AS count
+        {ORDER_ITEMS_FROM}
+        WHERE o.increment_id IS NOT NULL
+        GROUP BY o.increment_id, c.name
+    """,
+    'summary_stats': f"""
+        SELECT (SELECT COUNT(*) {ORDERS_FROM}) AS order_count,
+               (SELECT TOTAL(o.grand_total) {ORDERS_FROM}) AS total_sales,
+               (SELECT AVG(o.grand_total) {ORDERS_FROM}) AS avg_order_value,
+               (SELECT COUNT(DISTINCT c.name) {ORDER_ITEMS_FROM}) AS category_count,
+               (SELECT COUNT(DISTINCT o.customer_id) {ORDERS_FROM}) AS customer_count
+    """
+}
+
+# ETL 維護的彙總表 (見 SUMMARY_REFRESH)：資料庫中有這些表時，以下分析改讀彙總表，成本只與日期數、顧客數有關
+SUMMARY_TABLES = {'daily_sales', 'daily_category_revenue', 'customer_totals'}
+SUMMARY_QUERIES = {
+    'sales_trends': """
+        SELECT order_date, SUM(grand_total) AS grand_total
+        FROM daily_sales
+        WHERE order_date IS NOT NULL
+        GROUP BY order_date
+        ORDER BY order_date
+    """,
+    'category_distribution': """
+        SELECT c.name AS category_name, SUM(d.qty_ordered) AS qty_ordered, SUM(d.revenue) AS revenue
+        FROM daily_category_revenue d JOIN categories c ON d.category_id = c.category_id
+        GROUP BY c.name
+    """,
+    'payment_methods': """
+        SELECT payment_method, SUM(order_count) AS count
+        FROM daily_sales
+        WHERE payment_method IS NOT NULL
+        GROUP BY payment_method
+        ORDER BY count DESC
+    """,
+    'order_status': """
+        SELECT status, SUM(order_count) AS count
+        FROM daily_sales
+        GROUP BY status
+        ORDER BY count DESC
+    """,
+    'customer_behavior': """
+        SELECT customer_id, order_count, total_spent,
+               total_spent / NULLIF(valued_orders, 0) AS avg_order_value,
+               (strftime('%s', last_order_at) - strftime('%s', first_order_at)) / 86400 AS days_active
+        FROM customer_totals
+    """,
+    'summary_stats': """
+        SELECT (SELECT IFNULL(SUM(order_count), 0) FROM daily_sales) AS order_count,
+               (SELECT TOTAL(grand_total) FROM daily_sales) AS total_sales,
+               (SELECT SUM(grand_total) / SUM(valued_orders) FROM daily_sales) AS avg_order_value,
+               (SELECT COUNT(DISTINCT c.name)
+                FROM daily_category_revenue d JOIN categories c ON d.category_id = c.category_id) AS category_count,
+               (SELECT COUNT(*) FROM customer_totals) AS customer_count
+    """
+}
+
+# 圖表輸出目錄；繪圖函式只接收彙總結果與輸出路徑，可以在子程序中執行
+IMAGE_DIR = './data/processed/image'
+
+def plot_sales_trends(daily_sales, path):
+    plt.figure(figsize=(15, 6))
+    plt.plot(daily_sales['order_date'], daily_sales['grand_total'])
+    plt.title('每日銷售額趨勢')
+    plt.xlabel('日期')
+    plt.ylabel('銷售額')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_category_distribution(category_sales, path):
+    plt.figure(figsize=(12, 6))
+    sns.barplot(data=category_sales.sort_values('revenue', ascending=False),
+               x='category_name', y='revenue')
+    plt.title('各類別銷售總額')
+    plt.xlabel('類別')
+    plt.ylabel('銷售額')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_payment_methods(payment_stats, path):
+    plt.figure(figsize=(10, 6))
+    payment_stats.plot(kind='pie', autopct='%1.1f%%')
+    plt.title('支付方式分布')
+    plt.axis('equal')
+    plt.savefig(path)
+    plt.close()
+
+def plot_order_status(status_stats, path):
+    plt.figure(figsize=(10, 6))
+    status_stats.plot(kind='bar')
+    plt.title('訂單狀態分布')
+    plt.xlabel('狀態')
+    plt.ylabel('訂單數量')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_hourly_patterns(hourly_orders, path):
+    plt.figure(figsize=(12, 6))
+    hourly_orders.plot(kind='line', marker='o')
+    plt.title('每小時訂單量分布')
+    plt.xlabel('小時')
+    plt.ylabel('訂單數量')
+    plt.grid(True)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_price_distribution(price_dist, path):
+    plt.figure(figsize=(10, 6))
+    price_dist.plot(kind='bar')
+    plt.title('商品價格區間分布')
+    plt.xlabel('價格區間')
+    plt.ylabel('商品數量')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_category_correlations(category_corr, path):
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(category_corr, annot=True, cmap='coolwarm', center=0)
+    plt.title('類別關聯性熱力圖')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def plot_customer_behavior(customer_stats, path):
+    # 繪製消費頻率分布圖
+    plt.figure(figsize=(10, 6))
+    sns.histplot(data=customer_stats, x='purchase_frequency', bins=50)
+    plt.title('客戶購買頻率分布')
+    plt.xlabel('每日平均購買頻率')
+    plt.ylabel('客戶數量')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+# 分析名稱 -> (繪圖函式, 輸出檔名)，依 main() 的執行順序排列
+CHARTS = {
+    'sales_trends': (plot_sales_trends, 'daily_sales_trend.png'),
+    'category_distribution': (plot_category_distribution, 'category_sales.png'),
+    'payment_methods': (plot_payment_methods, 'payment_methods.png'),
+    'order_status': (plot_order_status, 'order_status.png'),
+    'hourly_patterns': (plot_hourly_patterns, 'hourly_orders.png'),
+    'price_distribution': (plot_price_distribution, 'price_distribution.png'),
+    'category_correlations': (plot_category_correlations, 'category_correlations.png'),
+    'customer_behavior': (plot_customer_behavior, 'customer_purchase_frequency.png')
+}
+
+# 分析結果快取：鍵值由來源資料表指紋與分析參數組成，來源未變動時直接讀取 Parquet
+CACHE_DIR = './data/processed/cache'
+# 分析邏輯變動時遞增，讓既有快取失效
+CACHE_VERSION = 1
+SOURCE_TABLES = ['orders', 'customers', 'order_items', 'products', 'categories']
+# 記錄各圖表最後一次繪製時的快取鍵值，鍵值相同且圖檔存在時不重新繪製
+RENDERED_MANIFEST = 'rendered.json'
+SERIES_COLUMN = 'value'
+
+def write_result(result, path):
+    """將分析結果存成 Parquet；Series 轉成單欄 DataFrame，原本的名稱記在 attrs"""
+    if isinstance(result, pd.Series):
+        frame = result.to_frame(SERIES_COLUMN)
+        frame.attrs['series_name'] = result.name
+    else:
+        frame = result
+    frame.to_parquet(path)
+
+def read_result(path):
+    frame = pd.read_parquet(path)
+    if 'series_name' in frame.attrs:
+        return frame[SERIES_COLUMN].rename(frame.attrs['series_name'])
+    return frame
+
+def load_manifest(cache_dir):
+    path = os.path.join(cache_dir, RENDERED_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(cache_dir, manifest):
+    with open(os.path.join(cache_dir, RENDERED_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def render_chart(name, data):
+    """繪製單一圖表並回傳耗時 (秒)"""
+    plot, filename = CHARTS[name]
+    start = time.perf_counter()
+    plot(data, f'{IMAGE_DIR}/{filename}')
+    return time.perf_counter() - start
+
+def render_charts(results, workers=1):
+    """繪製所有圖表，回傳各圖表的繪圖耗時；workers > 1 時分散到多個程序 (matplotlib 不是 thread-safe)"""
+    if workers <= 1:
+        return {name: render_chart(name, data) for name, data in results.items()}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(render_chart, name, data) for name, data in results.items()}
+        return {name: future.result() for name, future in futures.items()}
+
 class EcommerceAnalyzer:
-    def __init__(self, db_path='ecommerce.db'):
+    def __init__(self, db_path='ecommerce.db', pushdown=False, cache_dir=None, summaries=None):
+        self.db_path = db_path
         self.conn = sqlite3.connect(db_path)
+        # cache_dir 為 None 時不使用分析結果快取
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.fingerprint = None
+        # pushdown 可為 True/False，或要在 SQLite 彙總的分析名稱集合 (其餘沿用 pandas)
+        self.pushdown = pushdown
+        # summaries 為 None 時，資料庫中有 ETL 維護的彙總表就改讀彙總表
+        if summaries is None:
+            tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            summaries = SUMMARY_TABLES <= tables
+        self.summaries = summaries
+        # 已載入的欄位快取，依資料集分開，跨分析共用
+        self.frames = {}
+
+    @property
+    def orders_df(self):
+        return self.frames.get('orders')
+
+    @property
+    def order_items_df(self):
+        return self.frames.get('order_items')
         
     def load_data(self):
-        # 載入主要分析所需的資料
-        self.orders_df = pd.read_sql("""
-            SELECT o.*, c.customer_since
-            FROM orders o
-            JOIN customers c ON o.customer_id = c.customer_id
-        """, self.conn)
-        
-        self.order_items_df = pd.read_sql("""
-            SELECT oi.*, p.sku, c.name as category_name
-            FROM order_items oi
-            JOIN products p ON oi.product_id = p.product_id
-            JOIN categories c ON p.category_id = c.category_id
-        """, self.conn)
-        
-    def analyze_sales_trends(self):
-        # 將 created_at 轉換為日期格式
-        self.orders_df['created_at'] = pd.to_datetime(self.orders_df['created_at'])
-        
-        # 按日期統計銷售額
-        daily_sales = self.orders_df.groupby('created_at')['grand_total'].sum().reset_index()
-        
-        plt.figure(figsize=(15, 6))
-        plt.plot(daily_sales['created_at'], daily_sales['grand_total'])
-        plt.title('每日銷售額趨勢')
-        plt.xlabel('日期')
-        plt.ylabel('銷售額')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/daily_sales_trend.png')
-        plt.close()
-        
-    def analyze_category_distribution(self):
+        # 一次載入全部欄位；各分析預設只會延遲載入自己需要的欄位
+        for dataset in DATASETS:
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({dataset})")]
+            self.load(dataset, columns + list(COLUMN_EXPRESSIONS[dataset]))
+
+    def load(self, dataset, columns):
+        """回傳指定欄位，只向資料庫查詢快取中還沒有的欄位"""
+        frame = self.frames.get(dataset)
+        missing = [column for column in columns if frame is None or column not in frame.columns]
+        if missing:
+            fetched = self.fetch(dataset, missing)
+            frame = fetched if frame is None else frame.join(fetched)
+            self.frames[dataset] = frame
+        return frame[columns]
+
+    def fetch(self, dataset, columns):
+        alias, source, key = DATASETS[dataset]
+        expressions = [f"{alias}.{key} AS row_key"] + [
+            f"{COLUMN_EXPRESSIONS[dataset].get(column, f'{alias}.{column}')} AS {column}" for column in columns
+        ]
+        frame = pd.read_sql(
+            f"SELECT {', '.join(expressions)} {source}", self.conn, index_col='row_key',
+            parse_dates={column: DATE_COLUMNS[column] for column in columns if column in DATE_COLUMNS}
+        )
+        for column in CATEGORY_COLUMNS.intersection(columns):
+            frame[column] = frame[column].astype('category')
+        return frame.rename_axis(None)
+
+    def use_summary(self, name):
+        return self.summaries and name in SUMMARY_QUERIES
+
+    def use_pushdown(self, name, pushdown=None):
+        # 讀取彙總表同樣是只取回 SQL 彙總結果，沿用 push-down 的後續處理
+        if self.use_summary(name):
+            return True
+        if pushdown is None:
+            pushdown = self.pushdown
+        if isinstance(pushdown, bool):
+            return pushdown
+        return name in pushdown
+
+    def query(self, name, **kwargs):
+        queries = SUMMARY_QUERIES if self.use_summary(name) else PUSHDOWN_QUERIES
+        return pd.read_sql(queries[name], self.conn, **kwargs)
+
+    def source_fingerprint(self):
+        """來源資料表的指紋：各表筆數與最大 rowid、資料庫檔案修改時間與 WAL 大小"""
+        if self.fingerprint is None:
+            tables = {
+                table: list(self.conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone())
+                for table in SOURCE_TABLES
+            }
+            # 讀取端開啟連線也會建立 WAL 檔，因此只看大小不看修改時間
+            wal_path = f'{self.db_path}-wal'
+            self.fingerprint = {
+                'tables': tables,
+                'mtime': os.stat(self.db_path).st_mtime_ns,
+                'wal_size': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+            }
+        return self.fingerprint
+
+    def cache_key(self, name, pushdown=None):
+        params = {
+            'version': CACHE_VERSION,
+            'source': self.source_fingerprint(),
+            'name': name,
+            'pushdown': self.use_pushdown(name, pushdown),
+            'summary': self.use_summary(name)
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+    def cached(self, name, compute, pushdown=None):
+        """回傳 compute() 的結果；快取中已有相同鍵值的 Parquet 時直接讀取"""
+        if self.cache_dir is None:
+            return compute()
+        path = os.path.join(self.cache_dir, f'{name}-{self.cache_key(name, pushdown)}.parquet')
+        if os.path.exists(path):
+            return read_result(path)
+
+        result = compute()
+        # 同一分析只保留最新的快取檔
+        for stale in glob.glob(os.path.join(self.cache_dir, f'{name}-*.parquet')):
+            os.remove(stale)
+        write_result(result, path)
+        return result
+
+    def chart_data(self, name, pushdown=None):
+        """回傳繪製 CHARTS[name] 所需的彙總結果"""
+        def compute():
+            data = getattr(self, f'compute_{name}')(pushdown)
+            # compute_order_status 另外回傳訂單總數，繪圖只需要各狀態訂單數
+            return data[0] if name == 'order_status' else data
+        return self.cached(name, compute, pushdown)
+
+    def compute_sales_trends(self, pushdown=None):
+        if self.use_pushdown('sales_trends', pushdown):
+            return self.query('sales_trends', parse_dates=['order_date'])
+        # 按日期統計銷售額 (order_date 由 ETL 預先計算)
+        orders = self.load('orders', ['order_date', 'grand_total'])
+        return orders.groupby('order_date')['grand_total'].sum().reset_index()
+
+    def analyze_sales_trends(self, pushdown=None):
+        daily_sales = self.compute_sales_trends(pushdown)
+        plot_sales_trends(daily_sales, f'{IMAGE_DIR}/daily_sales_trend.png')
+
+    def compute_category_distribution(self, pushdown=None):
+        if self.use_pushdown('category_distribution', pushdown):
+            return self.query('category_distribution')
         # 分析類別分布
-        category_sales = self.order_items_df.groupby('category_name').agg({
-            'qty_ordered': 'sum',
-            'price': lambda x: (x * self.order_items_df.loc[x.index, 'qty_ordered']).sum()
-        }).reset_index()
+        items = self.load('order_items', ['category_name', 'qty_ordered', 'line_total'])
+        return items.groupby('category_name', observed=True).sum().rename(columns={'line_total': 'revenue'}).reset_index()
         
-        plt.figure(figsize=(12, 6))
-        sns.barplot(data=category_sales.sort_values('price', ascending=False),
-                   x='category_name', y='price')
-        plt.title('各類別銷售總額')
-        plt.xlabel('類別')
-        plt.ylabel('銷售額')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/category_sales.png')
-        plt.close()
-        
-    def analyze_payment_methods(self):
+    def analyze_category_distribution(self, pushdown=None):
+        category_sales = self.compute_category_distribution(pushdown)
+        plot_category_distribution(category_sales, f'{IMAGE_DIR}/category_sales.png')
+
+    def compute_payment_methods(self, pushdown=None):
+        if self.use_pushdown('payment_methods', pushdown):
+            return self.query('payment_methods', index_col='payment_method')['count']
         # 分析支付方式
-        payment_stats = self.orders_df['payment_method'].value_counts()
+        return self.load('orders', ['payment_method'])['payment_method'].value_counts()
         
-        plt.figure(figsize=(10, 6))
-        payment_stats.plot(kind='pie', autopct='%1.1f%%')
-        plt.title('支付方式分布')
-        plt.axis('equal')
-        plt.savefig('./data/processed/image/payment_methods.png')
-        plt.close()
+    def analyze_payment_methods(self, pushdown=None):
+        payment_stats = self.compute_payment_methods(pushdown)
+        plot_payment_methods(payment_stats, f'{IMAGE_DIR}/payment_methods.png')
         
-    def generate_summary_stats(self):
+    def generate_summary_stats(self, pushdown=None):
+        if self.use_pushdown('summary_stats', pushdown):
+            stats = self.query('summary_stats').to_dict('records')[0]
+        else:
+            orders = self.load('orders', ['grand_total', 'customer_id'])
+            items = self.load('order_items', ['category_name'])
+            stats = {
+                'order_count': len(orders),
+                'total_sales': orders['grand_total'].sum(),
+                'avg_order_value': orders['grand_total'].mean(),
+                'category_count': items['category_name'].nunique(),
+                'customer_count': orders['customer_id'].nunique()
+            }
         # 產生摘要統計
         summary = {
-            '訂單總數': f"{len(self.orders_df):,}",
-            '總銷售額': f"${self.orders_df['grand_total'].sum():,.2f}",
-            '平均訂單金額': f"${self.orders_df['grand_total'].mean():,.2f}",
-            '不同商品類別數': f"{self.order_items_df['category_name'].nunique():,}",
-            '不同顧客數': f"{self.orders_df['customer_id'].nunique():,}"
+            '訂單總數': f"{stats['order_count']:,}",
+            '總銷售額': f"${stats['total_sales']:,.2f}",
+            '平均訂單金額': f"${stats['avg_order_value']:,.2f}",
+            '不同商品類別數': f"{stats['category_count']:,}",
+            '不同顧客數': f"{stats['customer_count']:,}"
         }
         return pd.Series(summary)
-    
-    def analyze_order_status(self):
+
+    def compute_order_status(self, pushdown=None):
+        """回傳 (各狀態訂單數, 訂單總數)；訂單總數包含沒有狀態的訂單"""
+        if self.use_pushdown('order_status', pushdown):
+            status_stats = self.query('order_status', index_col='status')['count']
+            return status_stats[status_stats.index.notna()], int(status_stats.sum())
         # 分析訂單狀態分布
-        status_stats = self.orders_df['status'].value_counts()
-        
-        plt.figure(figsize=(10, 6))
-        status_stats.plot(kind='bar')
-        plt.title('訂單狀態分布')
-        plt.xlabel('狀態')
-        plt.ylabel('訂單數量')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/order_status.png')
-        plt.close()
+        status = self.load('orders', ['status'])['status']
+        return status.value_counts(), len(status)
+    
+    def analyze_order_status(self, pushdown=None):
+        status_stats, order_count = self.compute_order_status(pushdown)
+        plot_order_status(status_stats, f'{IMAGE_DIR}/order_status.png')
         
         # 計算訂單完成率
-        completion_rate = (status_stats['complete'] / len(self.orders_df)) * 100
+        completion_rate = (status_stats['complete'] / order_count) * 100
         return f"訂單完成率: {completion_rate:.2f}%"
 
-    def analyze_hourly_patterns(self):
-        # 提取小時資訊
-        self.orders_df['hour'] = pd.to_datetime(self.orders_df['created_at']).dt.hour
-        
-        # 分析每小時訂單量
-        hourly_orders = self.orders_df.groupby('hour').size()
-        
-        plt.figure(figsize=(12, 6))
-        hourly_orders.plot(kind='line', marker='o')
-        plt.title('每小時訂單量分布')
-        plt.xlabel('小時')
-        plt.ylabel('訂單數量')
-        plt.grid(True)
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/hourly_orders.png')
-        plt.close()
-
-    def analyze_price_distribution(self):
+    def compute_hourly_patterns(self, pushdown=None):
+        if self.use_pushdown('hourly_patterns', pushdown):
+            return self.query('hourly_patterns', index_col='order_hour')['count']
+        # 分析每小時訂單量 (order_hour 由 ETL 預先計算)
+        return self.load('orders', ['order_hour']).groupby('order_hour').size()
+
+    def analyze_hourly_patterns(self, pushdown=None):
+        hourly_orders = self.compute_hourly_patterns(pushdown)
+        plot_hourly_patterns(hourly_orders, f'{IMAGE_DIR}/hourly_orders.png')
+
+    def compute_price_distribution(self, pushdown=None):
+        if self.use_pushdown('price_distribution', pushdown):
+            price_dist = self.query('price_distribution', index_col='price_range')['count']
+            return price_dist.reindex(PRICE_LABELS, fill_value=0)
         # 建立價格區間
-        self.order_items_df['price_range'] = pd.cut(
-            self.order_items_df['price'],
-            bins=[0, 500, 1000, 5000, 10000, float('inf')],
-            labels=['0-500', '501-1000', '1001-5000', '5001-10000', '10000+']
+        price_range = pd.cut(
+            self.load('order_items', ['price'])['price'],
+            bins=PRICE_BINS,
+            labels=PRICE_LABELS
         )
         
         # 分析價格區間分布
-        price_dist = self.order_items_df['price_range'].value_counts().sort_index()
-        
-        plt.figure(figsize=(10, 6))
-        price_dist.plot(kind='bar')
-        plt.title('商品價格區間分布')
-        plt.xlabel('價格區間')
-        plt.ylabel('商品數量')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/price_distribution.png')
-        plt.close()
-
-    def analyze_category_correlations(self):
-        # 建立購物籃分析矩陣
-        order_categories = self.order_items_df.groupby(['order_id', 'category_name']).size().unstack(fill_value=0)
-        
-        # 計算類別間的相關性
-        category_corr = order_categories.corr()
-        
-        plt.figure(figsize=(12, 10))
-        sns.heatmap(category_corr, annot=True, cmap='coolwarm', center=0)
-        plt.title('類別關聯性熱力圖')
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/category_correlations.png')
-        plt.close()
-
-    def analyze_customer_behavior(self):
-        # 計算每個客戶的統計數據
-        customer_stats = self.orders_df.groupby('customer_id').agg({
-            'order_id': 'count',
-            'grand_total': ['sum', 'mean'],
-            'created_at': lambda x: (x.max() - x.min()).days
-        }).reset_index()
-        
-        customer_stats.columns = ['customer_id', 'order_count', 'total_spent', 'avg_order_value', 'days_active']
+        return price_range.value_counts().sort_index()
+
+    def analyze_price_distribution(self, pushdown=None):
+        price_dist = self.compute_price_distribution(pushdown)
+        plot_price_distribution(price_dist, f'{IMAGE_DIR}/price_distribution.png')
+
+    def basket_matrix(self, pushdown=None):
+        """回傳 (購物籃 CSR 稀疏矩陣, 類別名稱)：列為訂單、欄為類別，值為該訂單在該類別的明細數"""
+        # ETL 每一行明細各寫一筆 orders，同一張訂單的明細以 increment_id 歸為同一個購物籃
+        if self.use_pushdown('category_correlations', pushdown):
+            basket = self.query('category_correlations')
+            order_ids, categories, counts = basket['increment_id'], basket['category_name'], basket['count']
+        else:
+            items = self.load('order_items', ['increment_id', 'category_name']).dropna(subset=['increment_id'])
+            order_ids, categories, counts = items['increment_id'], items['category_name'], np.ones(len(items))
+
+        # 建立購物籃分析矩陣：只存非零值，重複的 (訂單, 類別) 在轉成 CSR 時自動加總
+        rows, _ = pd.factorize(order_ids)
+        columns, names = pd.factorize(categories, sort=True)
+        matrix = sparse.csr_matrix(
+            (np.asarray(counts, dtype=float), (rows, columns)),
+            shape=(rows.max() + 1 if len(rows) else 0, len(names))
+        )
+        return matrix, pd.Index(np.asarray(names), name='category_name')
+
+    def compute_category_correlations(self, pushdown=None):
+        matrix, names = self.basket_matrix(pushdown)
+        n = matrix.shape[0]
+        if n < 2:
+            # 與 DataFrame.corr 相同：少於兩筆訂單時相關係數沒有定義，整個矩陣為 NaN
+            return pd.DataFrame(np.nan, index=names, columns=names.rename(None))
+
+        # 計算類別間的相關性：Pearson 相關係數以 X^T X 與欄平均推導，不需展開成密集矩陣
+        means = np.asarray(matrix.mean(axis=0)).ravel()
+        gram = (matrix.T @ matrix).toarray()
+        covariance = (gram - n * np.outer(means, means)) / (n - 1)
+        # 變異數為 0 (或捨入後略小於 0) 的類別相關係數為 NaN，與 DataFrame.corr 一樣不發出警告
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(np.diag(covariance))
+            correlation = covariance / np.outer(std, std)
+        return pd.DataFrame(correlation, index=names, columns=names.rename(None))
+
+    def compute_category_pairs(self, pushdown=None, min_support=0.0):
+        """類別配對的共同出現次數、support 與 lift，以 lift 由高到低排序"""
+        matrix, names = self.basket_matrix(pushdown)
+        n = matrix.shape[0]
+
+        # 只看訂單是否包含該類別，B^T B 即為兩兩類別共同出現的訂單數
+        present = (matrix > 0).astype(float)
+        together = (present.T @ present).toarray()
+        support = np.diag(together) / n
+        first, second = np.triu_indices(len(names), k=1)
+        pair_support = together[first, second] / n
+        pairs = pd.DataFrame({
+            'category_a': names[first],
+            'category_b': names[second],
+            'orders': together[first, second].astype(int),
+            'support': pair_support,
+            'lift': pair_support / (support[first] * support[second])
+        })
+        pairs = pairs[pairs['support'] >= min_support]
+        return pairs.sort_values('lift', ascending=False).reset_index(drop=True)
+
+    def analyze_category_correlations(self, pushdown=None):
+        category_corr = self.compute_category_correlations(pushdown)
+        plot_category_correlations(category_corr, f'{IMAGE_DIR}/category_correlations.png')
+
+    def compute_customer_behavior(self, pushdown=None):
+        if self.use_pushdown('customer_behavior', pushdown):
+            customer_stats = self.query('customer_behavior')
+        else:
+            # 計算每個客戶的統計數據
+            orders = self.load('orders', ['customer_id', 'order_id', 'grand_total', 'created_at'])
+            customer_stats = orders.groupby('customer_id').agg({
+                'order_id': 'count',
+                'grand_total': ['sum', 'mean'],
+                'created_at': lambda x: (x.max() - x.min()).days
+            }).reset_index()
+            
+            customer_stats.columns = ['customer_id', 'order_count', 'total_spent', 'avg_order_value', 'days_active']
         
         # 計算客戶存活期間的平均消費頻率
         customer_stats['purchase_frequency'] = customer_stats['order_count'] / customer_stats['days_active'].clip(lower=1)
-        
-        # 繪製消費頻率分布圖
-        plt.figure(figsize=(10, 6))
-        sns.histplot(data=customer_stats, x='purchase_frequency', bins=50)
-        plt.title('客戶購買頻率分布')
-        plt.xlabel('每日平均購買頻率')
-        plt.ylabel('客戶數量')
-        plt.tight_layout()
-        plt.savefig('./data/processed/image/customer_purchase_frequency.png')
-        plt.close()
+        return customer_stats
+
+    def analyze_customer_behavior(self, pushdown=None):
+        customer_stats = self.compute_customer_behavior(pushdown)
+        plot_customer_behavior(customer_stats, f'{IMAGE_DIR}/customer_purchase_frequency.png')
 
 def main():
-    analyzer = EcommerceAnalyzer()
-    analyzer.load_data()
+    parser = argparse.ArgumentParser(description='電商平台資料分析')
+    parser.add_argument('--pushdown', action='store_true', help='在 SQLite 中完成彙總，只取回彙總結果')
+    parser.add_argument('--workers', type=int, default=1, help='平行繪圖的程序數，1 表示在主程序依序繪圖')
+    parser.add_argument('--no-cache', action='store_true', help='不使用分析結果快取，全部重新計算與繪圖')
+    parser.add_argument('--no-summaries', action='store_true', help='不讀取 ETL 維護的彙總表，改從明細資料彙總')
+    args = parser.parse_args()
+
+    # 各分析只會載入自己需要的欄位；push-down 模式下則完全在 SQLite 中彙總
+    cache_dir = None if args.no_cache else CACHE_DIR
+    analyzer = EcommerceAnalyzer(pushdown=args.pushdown, cache_dir=cache_dir,
+                                 summaries=False if args.no_summaries else None)
+    rendered = {} if cache_dir is None else load_manifest(cache_dir)
     
-    # 執行各項分析
-    analyzer.analyze_sales_trends()
-    analyzer.analyze_category_distribution()
-    analyzer.analyze_payment_methods()
-    analyzer.analyze_order_status()
-    analyzer.analyze_hourly_patterns()
-    analyzer.analyze_price_distribution()
-    analyzer.analyze_category_correlations()
-    analyzer.analyze_customer_behavior()
+    # 執行各項分析：先在主程序完成所有彙總，再把彙總結果交給繪圖程序
+    # 來源資料與參數都沒有變動、圖檔也還在的圖表直接略過
+    results, keys, compute_times = {}, {}, {}
+    for name, (_, filename) in CHARTS.items():
+        start = time.perf_counter()
+        if cache_dir is not None:
+            keys[name] = analyzer.cache_key(name)
+            if rendered.get(name) == keys[name] and os.path.exists(f'{IMAGE_DIR}/{filename}'):
+                continue
+        results[name] = analyzer.chart_data(name)
+        compute_times[name] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    render_times = render_charts(results, args.workers)
+    render_wall = time.perf_counter() - start
+    if cache_dir is not None:
+        rendered.update({name: keys[name] for name in results})
+        save_manifest(cache_dir, rendered)
+
+    print("\n=== 各圖表耗時 (秒) ===")
+    for name in CHARTS:
+        if name in results:
+            print(f"{name:<24} 彙總 {compute_times[name]:6.2f}  繪圖 {render_times[name]:6.2f}")
+        else:
+            print(f"{name:<24} 未變動，略過")
+    print(f"繪圖總耗時 {render_wall:.2f} 秒 (workers={args.workers})")
     
     # 印出摘要統計
     print("\n=== 電商平台分析摘要 ===")
-    print(analyzer.generate_summary_stats())
+    print(analyzer.cached('summary_stats', analyzer.generate_summary_stats))
 
 if __name__ == "__main__":
     main()
@@ -1,113 +1,542 @@
+import logging
+import os
+import time
+import numpy as np
 import pandas as pd
-from src.database.models import Customer, Category, Product, Order, OrderItem
+from sqlalchemy import select, delete, func, Date
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.database.models import Customer, Category, Product, Order, OrderItem, DailySales
 from src.database.database_manager import DatabaseManager
+from src.analytics.common import raw_cache, run_pipeline
+
+# 共用模組 (etl_common) 的快取與管線訊息以 logging 輸出，格式與本專案的 print 輸出一致
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+LOAD_MODES = ('orm', 'bulk')
+
+# 每一行 CSV 寫入 orders / order_items 的欄位
+ORDER_COLUMNS = ['order_id', 'increment_id', 'customer_id', 'status', 'created_at', 'order_date', 'order_hour',
+                 'payment_method', 'grand_total', 'discount_amount', 'sales_commission_code', 'bi_status', 'row_hash']
+ORDER_ITEM_COLUMNS = ['order_id', 'product_id', 'qty_ordered', 'price', 'line_total']
+
+# 清理階段向量化轉型的欄位：數值與日期欄位無法解析時記錄到 rejected rows 報告，文字欄位缺值保留為 NA
+NUMERIC_COLUMNS = ['price', 'qty_ordered', 'grand_total', 'discount_amount', 'Customer ID']
+# 日期欄位與資料集的格式，不符合的值再以 format='mixed' 逐筆解析
+DATETIME_COLUMNS = {'created_at': '%m/%d/%Y', 'Customer Since': '%Y-%m'}
+TEXT_COLUMNS = ['increment_id', 'status', 'payment_method', 'sales_commission_code', 'BI Status', 'sku',
+                'category_name_1']
+
+# 彙總表的重算條件：只重算本次載入影響到的日期 (含 NULL 日期) 與顧客
+TOUCHED_DATES = "({column} IN (SELECT key FROM touched_dates) OR ({column} IS NULL AND EXISTS (SELECT 1 FROM touched_dates WHERE key IS NULL)))"
+TOUCHED_CUSTOMERS = "{column} IN (SELECT key FROM touched_customers)"
+
+# 彙總表 -> (重算條件, 彙總鍵欄位, 重新彙總的 INSERT ... SELECT)，{where} 在完整重算時為空
+SUMMARY_REFRESH = {
+    'daily_sales': (TOUCHED_DATES, 'order_date', """
+        INSERT INTO daily_sales (order_date, payment_method, status, order_count, valued_orders, grand_total)
+        SELECT o.order_date, o.payment_method, o.status, COUNT(*), COUNT(o.grand_total), SUM(o.grand_total)
+        FROM orders o JOIN customers c ON o.customer_id = c.customer_id
+        {where}
+        GROUP BY o.order_date, o.payment_method, o.status
+    """),
+    'daily_category_revenue': (TOUCHED_DATES, 'order_date', """
+        INSERT INTO daily_category_revenue (order_date, category_id, line_count, qty_ordered, revenue)
+        SELECT o.order_date, p.category_id, COUNT(*), SUM(oi.qty_ordered), SUM(oi.line_total)
+        FROM order_items oi
+        JOIN products p ON oi.product_id = p.product_id
+        LEFT JOIN orders o ON oi.order_id = o.order_id
+        {where}
+        GROUP BY o.order_date, p.category_id
+    """),
+    'customer_totals': (TOUCHED_CUSTOMERS, 'customer_id', """
+        INSERT INTO customer_totals (customer_id, order_count, valued_orders, total_spent, first_order_at, last_order_at)
+        SELECT o.customer_id, COUNT(o.order_id), COUNT(o.grand_total), TOTAL(o.grand_total),
+               MIN(o.created_at), MAX(o.created_at)
+        FROM orders o JOIN customers c ON o.customer_id = c.customer_id
+        {where}
+        GROUP BY o.customer_id
+    """)
+}
+
+# ETL 實際用到的 CSV 欄位，Unnamed: 21..25 等空白或未使用的欄位不解析
+CSV_COLUMNS = NUMERIC_COLUMNS + list(DATETIME_COLUMNS) + TEXT_COLUMNS
+# 低基數的文字欄位以 category dtype 讀取
+CATEGORY_COLUMNS = ['status', 'payment_method', 'BI Status', 'category_name_1']
+
+def parse_datetime(values, format):
+    parsed = pd.to_datetime(values, format=format, errors='coerce')
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], format='mixed', errors='coerce')
+    return parsed
+
+def row_hash(frame):
+    # 每列內容的 64 位元雜湊，增量載入時用來略過未變動的訂單
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+def coerce_columns(df):
+    """向量化轉換數值與日期欄位，回傳轉換結果與有值但無法解析的儲存格 (rejected rows 報告)"""
+    parsed = {column: pd.to_numeric(df[column], errors='coerce') for column in NUMERIC_COLUMNS}
+    for column, format in DATETIME_COLUMNS.items():
+        parsed[column] = parse_datetime(df[column], format)
+    rejected = []
+    for column in parsed:
+        bad = parsed[column].isna() & df[column].notna()
+        rejected.append(pd.DataFrame({
+            'row': df.index[bad],
+            'column': column,
+            'value': df.loc[bad, column].astype(str)
+        }))
+    return parsed, pd.concat(rejected, ignore_index=True)
+
+def order_lines(df):
+    """向量化整理每一行 CSV 的訂單、明細與維度欄位，缺值保留為 NA (寫入時為 NULL)
+
+    回傳 (lines, rejected)；不存取資料庫，由管線在子行程中執行。
+    """
+    parsed, rejected = coerce_columns(df)
+    created_at = parsed['created_at']
+    price = parsed['price']
+    qty = parsed['qty_ordered']
+    # order_items 的數量與單價不可為 NULL：任一缺值或無法解析時以 1 件、0 元計
+    invalid = qty.isna() | price.isna()
+    text = df[TEXT_COLUMNS].astype('string')
+    lines = pd.DataFrame({
+        'increment_id': text['increment_id'],
+        # customers.customer_id 為整數主鍵，先轉型才能與資料庫中的鍵值比對
+        'customer_id': parsed['Customer ID'].astype('Int64'),
+        'customer_since': parsed['Customer Since'],
+        'status': text['status'],
+        # 只在 ETL 解析一次，日期與小時另存欄位供 SQL 直接分組
+        'created_at': created_at,
+        'order_date': created_at.dt.normalize(),
+        'order_hour': created_at.dt.hour.astype('Int64'),
+        'payment_method': text['payment_method'],
+        'grand_total': parsed['grand_total'].astype('Float64'),
+        'discount_amount': parsed['discount_amount'].astype('Float64').fillna(0.0),
+        'sales_commission_code': text['sales_commission_code'],
+        'bi_status': text['BI Status'],
+        'sku': text['sku'],
+        'category_name': text['category_name_1'],
+        'product_price': price.astype('Float64').fillna(0.0),
+        'qty_ordered': qty.where(~invalid, 1).astype('Int64'),
+        'price': price.where(~invalid, 0.0).astype('Float64')
+    })
+    lines['line_total'] = lines['qty_ordered'] * lines['price']
+    lines['row_hash'] = row_hash(lines).view(np.int64)
+    return lines, rejected
 
 class ETLProcessor:
-    def __init__(self, csv_path):
-        self.df = pd.read_csv(
-            csv_path,
-            low_memory=False,
+    def __init__(self, csv_path, chunksize=None, mode='orm', incremental=False, batch_size=10000, load_profile=None,
+                 defer_indexes=True, rejects_path='./data/processed/rejected_rows.csv', raw_cache_dir=raw_cache.CACHE_DIR,
+                 engine='pyarrow', workers=1):
+        if mode not in LOAD_MODES:
+            raise ValueError(f"未知的載入模式: {mode}，可用模式: {LOAD_MODES}")
+        self.mode = mode
+        self.csv_path = csv_path
+        self.chunksize = chunksize
+        # 串流模式下平行整理 chunk 的子行程數，1 表示在主行程依序處理
+        self.workers = workers
+        # CSV 轉存的 Parquet 快取目錄，None 時每次都解析 CSV
+        self.raw_cache_dir = raw_cache_dir
+        self.incremental = incremental
+        self.load_profile = load_profile
+        self.batch_size = batch_size
+        self.read_options = dict(
+            usecols=CSV_COLUMNS,
             dtype={
                 'Customer ID': str,
                 'Customer Since': str,
                 'created_at': str,
                 'sku': str,
                 'increment_id': str,
-                'status': str,
-                'payment_method': str,
                 'sales_commission_code': str,
-                'BI Status': str
+                **{column: 'category' for column in CATEGORY_COLUMNS}
             }
         )
-        self.df.drop(['Unnamed: 21', 'Unnamed: 22', 'Unnamed: 23', 'Unnamed: 24', 'Unnamed: 25'], axis=1, inplace=True)
-        self.df.dropna(how='all',inplace=True)
-        self.db_manager = DatabaseManager()
-        
-    def transform_data(self):
+        # pyarrow 引擎以多執行緒解析整份檔案，但不支援 chunksize，串流模式沿用 C 引擎
+        if engine == 'pyarrow' and chunksize is None:
+            self.read_options['engine'] = 'pyarrow'
+        else:
+            # C 引擎預設的浮點數解析不一定取最接近的值，改用 round_trip 與 pyarrow 一致，
+            # 整份與串流讀取的數值 (與 row_hash) 才會相同
+            self.read_options['low_memory'] = False
+            self.read_options['float_precision'] = 'round_trip'
+        self.df = None
+        self.rows_processed = 0
+        self.rejects_path = rejects_path
+        self.rejected_count = 0
+        # 串流模式下延後到 process() 才逐塊讀取
+        if chunksize is None:
+            start = time.perf_counter()
+            self.df = self.clean_chunk(raw_cache.read_csv(csv_path, cache_dir=raw_cache_dir, **self.read_options))
+            memory = self.df.memory_usage(deep=True).sum() / 2**20
+            print(f"已載入 {len(self.df)} 筆資料，耗時 {time.perf_counter() - start:.2f} 秒 ({memory:.1f} MB)")
+        # 增量載入的 upsert 依賴 unique 索引，只有一般載入時才延後建立索引
+        self.db_manager = DatabaseManager(deferred_indexes=defer_indexes and not incremental)
+
+        # 已寫入資料庫的維度鍵值，跨 chunk 共用
+        self.customer_ids = set()
+        self.category_ids = {}
+        self.product_ids = {}
+        # 本次載入影響到的日期與顧客，載入完成後只重算這些彙總
+        self.touched_dates = set()
+        self.touched_customers = set()
+
+    def clean_chunk(self, df):
+        # Unnamed: 21..25 已由 usecols 排除，只需移除整列空白的資料
+        return df.dropna(how='all')
+
+    def iter_chunks(self):
+        if self.chunksize is None:
+            yield self.df
+            return
+        carry = None
+        chunks = raw_cache.read_csv(self.csv_path, chunksize=self.chunksize, cache_dir=self.raw_cache_dir,
+                                    **self.read_options)
+        for chunk in chunks:
+            chunk = self.clean_chunk(chunk)
+            if not self.incremental:
+                yield chunk
+                continue
+            # 增量模式以 increment_id 整筆訂單比對，chunk 尾端的訂單留到下一塊一起處理
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            if chunk.empty:
+                continue
+            increment_ids = chunk['increment_id'].astype(str)
+            tail = (increment_ids == increment_ids.iloc[-1]).to_numpy()
+            carry = chunk[tail]
+            if not tail.all():
+                yield chunk[~tail]
+        if carry is not None and len(carry):
+            yield carry
         
+    def transform_data(self, lines):
         records = []
         customers = {}
         categories = {}
         products = {}
-        
-        for _, row in self.df.iterrows():
-            try:
-                # 處理 Customer
-                customer_id = row['Customer ID']
-                if customer_id not in customers:
-                    customer = Customer(
-                        customer_id=customer_id,
-                        customer_since=str(row['Customer Since'])
-                    )
-                    customers[customer_id] = customer
-                    records.append(customer)
-                
-                # 處理 Category
-                category_name = str(row['category_name_1'])
-                if category_name not in categories:
-                    category = Category(name=category_name)
-                    categories[category_name] = category
-                    records.append(category)
-                
-                # 處理 Product
-                sku = str(row['sku'])
-                if sku not in products:
-                    try:
-                        price = float(row['price'])
-                    except (ValueError, TypeError):
-                        price = 0.0
-                        
-                    product = Product(
-                        sku=sku,
-                        price=price,
-                        category=categories[category_name]
-                    )
-                    products[sku] = product
-                    records.append(product)
-                
-                # 處理 Order
-                order = Order(
-                    increment_id=str(row['increment_id']),
-                    customer=customers[customer_id],
-                    status=str(row['status']),
-                    created_at=str(row['created_at']),
-                    payment_method=str(row['payment_method']),
-                    grand_total=float(row['grand_total']),
-                    discount_amount=float(row['discount_amount'] or 0),
-                    sales_commission_code=str(row['sales_commission_code']),
-                    bi_status=str(row['BI Status'])
-                )
-                records.append(order)
-                
-                # 處理 OrderItem
-                try:
-                    qty_ordered = int(row['qty_ordered'])
-                    item_price = float(row['price'])
-                except (ValueError, TypeError):
-                    qty_ordered = 1
-                    item_price = 0.0
-                    
-                order_item = OrderItem(
-                    order=order,
-                    product=products[sku],
-                    qty_ordered=qty_ordered,
-                    price=item_price
-                )
-                records.append(order_item)
-                
-            except Exception as e:
-                print(f"錯誤發生在處理第 {_} 行時: {str(e)}")
-                continue
-        
+
+        self.touch(lines['order_date'], lines['customer_id'])
+        lines = lines.astype(object).where(lines.notna(), None)
+        for line in lines.itertuples(index=False):
+            # 處理 Customer
+            customer_id = line.customer_id
+            if customer_id is not None and customer_id not in customers and customer_id not in self.customer_ids:
+                customer = Customer(customer_id=customer_id, customer_since=line.customer_since)
+                customers[customer_id] = customer
+                records.append(customer)
+
+            # 處理 Category
+            category_name = line.category_name
+            if category_name is not None and category_name not in categories and category_name not in self.category_ids:
+                category = Category(name=category_name)
+                categories[category_name] = category
+                records.append(category)
+
+            # 處理 Product (先前 chunk 已寫入的維度以外鍵 id 關聯)
+            sku = line.sku
+            if sku is not None and sku not in products and sku not in self.product_ids:
+                if category_name in categories:
+                    product = Product(sku=sku, price=line.product_price, category=categories[category_name])
+                else:
+                    product = Product(sku=sku, price=line.product_price, category_id=self.category_ids.get(category_name))
+                products[sku] = product
+                records.append(product)
+
+            # 處理 Order
+            order = Order(
+                increment_id=line.increment_id,
+                customer_id=customer_id,
+                status=line.status,
+                created_at=line.created_at,
+                order_date=line.order_date,
+                order_hour=line.order_hour,
+                payment_method=line.payment_method,
+                grand_total=line.grand_total,
+                discount_amount=line.discount_amount,
+                sales_commission_code=line.sales_commission_code,
+                bi_status=line.bi_status,
+                row_hash=line.row_hash
+            )
+            records.append(order)
+
+            # 處理 OrderItem
+            if sku in products:
+                order_item = OrderItem(order=order, product=products[sku], qty_ordered=line.qty_ordered, price=line.price,
+                                       line_total=line.line_total)
+            else:
+                order_item = OrderItem(order=order, product_id=self.product_ids.get(sku), qty_ordered=line.qty_ordered,
+                                       price=line.price, line_total=line.line_total)
+            records.append(order_item)
+
         return records
 
-    
-    def process(self):
-        records = self.transform_data()
+    def write_rejected(self, rejected):
+        # row 為 CSV 資料列的索引 (不含標題列)，串流模式下跨 chunk 連續
+        if rejected.empty or self.rejects_path is None:
+            return
+        os.makedirs(os.path.dirname(self.rejects_path) or '.', exist_ok=True)
+        first = self.rejected_count == 0
+        rejected.to_csv(self.rejects_path, mode='w' if first else 'a', header=first, index=False)
+        self.rejected_count += len(rejected)
+        print(f"{len(rejected)} 個欄位值無法解析，已記錄至 {self.rejects_path}")
+
+    def orm_load(self, lines):
+        records = self.transform_data(lines)
         self.db_manager.add_records(records)
+        self.remember_keys(records)
+
+    def bulk_load(self, lines):
+        """兩階段載入：先寫入預先配置主鍵的維度資料，再以 tuple 分批寫入訂單與明細"""
+        with self.db_manager.get_db_session() as session:
+            # 第一階段：只寫入資料庫中還沒有的維度，主鍵直接配置，不需寫入後再查回
+            customers = lines[['customer_id', 'customer_since']].dropna(subset=['customer_id'])
+            customers = customers.drop_duplicates('customer_id')
+            customers = customers[~customers['customer_id'].isin(self.customer_ids)]
+            self._insert_rows(session, Customer.__table__, customers)
+            self.customer_ids.update(customers['customer_id'])
+
+            names = pd.Series(lines['category_name'].dropna().unique())
+            names = names[~names.isin(self.category_ids)]
+            category_ids = self._next_ids(session, Category.category_id, len(names))
+            self._insert_rows(session, Category.__table__, pd.DataFrame({
+                'category_id': category_ids,
+                'name': names.to_numpy()
+            }))
+            self.category_ids.update(zip(names, category_ids.tolist()))
+
+            products = lines[['sku', 'category_name', 'product_price']].dropna(subset=['sku']).drop_duplicates('sku')
+            products = products[~products['sku'].isin(self.product_ids)]
+            product_ids = self._next_ids(session, Product.product_id, len(products))
+            self._insert_rows(session, Product.__table__, pd.DataFrame({
+                'product_id': product_ids,
+                'sku': products['sku'].to_numpy(),
+                'category_id': products['category_name'].map(self.category_ids).to_numpy(),
+                'price': products['product_price'].to_numpy()
+            }))
+            self.product_ids.update(zip(products['sku'], product_ids.tolist()))
+            session.commit()
+
+            # 第二階段：訂單與明細，每寫入一批就 commit
+            self._insert_order_lines(session, lines, commit=True)
+            self.touch(lines['order_date'], lines['customer_id'])
+
+    def incremental_load(self, lines):
+        """以自然鍵 upsert 維度資料，只重寫新增或內容有變動的訂單"""
+        with self.db_manager.get_db_session() as session:
+            customers = lines[['customer_id', 'customer_since']].dropna(subset=['customer_id'])
+            customers = customers.drop_duplicates('customer_id')
+            # 同一次執行中以第一次出現的維度資料為準 (與 transform_data 相同)，跨次執行才會更新
+            customers = customers[~customers['customer_id'].isin(self.customer_ids)]
+            self._upsert(session, Customer.__table__, 'customer_id', customers)
+            self.customer_ids.update(customers['customer_id'])
+
+            category_ids = self._load_categories(session, lines['category_name'].dropna().unique())
+            products = pd.DataFrame({
+                'sku': lines['sku'],
+                'category_id': lines['category_name'].map(category_ids),
+                'price': lines['product_price']
+            }).dropna(subset=['sku']).drop_duplicates('sku')
+            products = products[~products['sku'].isin(self.product_ids)]
+            self._touch_recategorized(session, products)
+            self._upsert(session, Product.__table__, 'sku', products)
+            skus = products['sku'].tolist()
+            for start in range(0, len(skus), 900):
+                batch = skus[start:start + 900]
+                self.product_ids.update(session.execute(
+                    select(Product.sku, Product.product_id).where(Product.sku.in_(batch))
+                ).all())
+
+            # 沒有 increment_id 的行無法與既有訂單比對，記錄後略過
+            missing = lines['increment_id'].isna()
+            self.write_rejected(pd.DataFrame({'row': lines.index[missing], 'column': 'increment_id', 'value': ''}))
+            lines = lines[~missing]
+            changed = self._changed_orders(session, lines)
+            lines = lines[lines['increment_id'].isin(changed)]
+            self._insert_order_lines(session, lines)
+            self.touch(lines['order_date'], lines['customer_id'])
+            print(f"重寫 {len(changed)} 筆新增或變動的訂單，共 {len(lines)} 行")
+
+    def _insert_order_lines(self, session, lines, commit=False):
+        # 每一行 CSV 對應一筆 Order 與一筆 OrderItem，order_id 預先配置
+        lines = lines.assign(
+            order_id=self._next_ids(session, Order.order_id, len(lines)),
+            product_id=lines['sku'].map(self.product_ids)
+        )
+        self._insert_rows(session, Order.__table__, lines[ORDER_COLUMNS], commit)
+        self._insert_rows(session, OrderItem.__table__, lines[ORDER_ITEM_COLUMNS], commit)
+
+    def _insert_rows(self, session, table, frame, commit=False):
+        # 日期欄位轉成與 SQLAlchemy 相同的 ISO 字串，NA -> None 後轉成 tuple，以 executemany 分批寫入
+        frame = frame.copy()
+        for column in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[column]):
+                format = '%Y-%m-%d' if isinstance(table.c[column].type, Date) else '%Y-%m-%d %H:%M:%S.%f'
+                frame[column] = frame[column].dt.strftime(format)
+        frame = frame.astype(object).where(frame.notna(), None)
+        columns = ', '.join(frame.columns)
+        placeholders = ', '.join('?' * len(frame.columns))
+        sql = f'INSERT INTO {table.name} ({columns}) VALUES ({placeholders})'
+        rows = list(map(tuple, frame.to_numpy().tolist()))
+        for start in range(0, len(rows), self.batch_size):
+            session.connection().exec_driver_sql(sql, rows[start:start + self.batch_size])
+            if commit:
+                session.commit()
+
+    def _next_ids(self, session, column, count):
+        start = (session.execute(select(func.max(column))).scalar() or 0) + 1
+        return np.arange(start, start + count)
+
+    def _seed_keys(self):
+        # bulk 模式重複執行時沿用資料庫中既有的維度鍵值
+        with self.db_manager.get_db_session() as session:
+            self.customer_ids.update(session.scalars(select(Customer.customer_id)))
+            self.category_ids.update(session.execute(select(Category.name, Category.category_id)).all())
+            self.product_ids.update(session.execute(select(Product.sku, Product.product_id)).all())
+
+    def _changed_orders(self, session, lines):
+        # 比對資料庫中同 increment_id 各行雜湊的總和 (uint64 溢位相加，與行的順序無關)，刪除變動訂單的舊資料
+        order_hash = pd.Series(lines['row_hash'].to_numpy().view(np.uint64), index=lines['increment_id'])
+        order_hash = order_hash.groupby(level=0).sum()
+        increment_ids = order_hash.index.tolist()
+        existing = []
+        for start in range(0, len(increment_ids), 900):
+            batch = increment_ids[start:start + 900]
+            existing += session.execute(
+                select(Order.increment_id, Order.order_id, Order.row_hash, Order.order_date, Order.customer_id)
+                .where(Order.increment_id.in_(batch))
+            ).all()
+        existing = pd.DataFrame(existing, columns=['increment_id', 'order_id', 'row_hash', 'order_date', 'customer_id'])
+        # 沒有 row_hash (NULL) 的訂單無法比對，視為已變動並重寫
+        hashes = existing['row_hash'].fillna(0).astype(np.int64).to_numpy().view(np.uint64)
+        existing_hash = pd.Series(hashes, index=existing['increment_id']).groupby(level=0).sum()
+        existing_hash = existing_hash.reindex(order_hash.index)
+        changed = order_hash.index[(order_hash != existing_hash).to_numpy()]
+
+        stale = existing[existing['increment_id'].isin(changed)]
+        # 被刪除的舊訂單所在的日期與顧客也要重算彙總
+        self.touch(pd.to_datetime(stale['order_date']), stale['customer_id'])
+        stale = stale['order_id'].tolist()
+        for start in range(0, len(stale), 900):
+            batch = stale[start:start + 900]
+            session.execute(delete(OrderItem).where(OrderItem.order_id.in_(batch)))
+            session.execute(delete(Order).where(Order.order_id.in_(batch)))
+        return set(changed)
+
+    def touch(self, order_dates, customer_ids):
+        # 日期以資料庫中的 ISO 字串記錄，NULL 日期的訂單同樣有一組彙總需要重算
+        self.touched_dates.update(order_dates.dt.strftime('%Y-%m-%d').astype(object).where(order_dates.notna(), None))
+        self.touched_customers.update(int(customer_id) for customer_id in customer_ids.dropna())
+
+    def _touch_recategorized(self, session, products):
+        # 商品被 upsert 到其他類別時，含有該商品的日期在類別營收彙總中都要重算
+        skus = products['sku'].tolist()
+        existing = []
+        for start in range(0, len(skus), 900):
+            batch = skus[start:start + 900]
+            existing += session.execute(
+                select(Product.sku, Product.product_id, Product.category_id).where(Product.sku.in_(batch))
+            ).all()
+        existing = pd.DataFrame(existing, columns=['sku', 'product_id', 'category_id'])
+        merged = existing.merge(products[['sku', 'category_id']], how='left', on='sku', suffixes=('', '_new'))
+        old = pd.to_numeric(merged['category_id'])
+        new = pd.to_numeric(merged['category_id_new'])
+        moved = merged.loc[(old != new) & ~(old.isna() & new.isna()), 'product_id'].tolist()
+        for start in range(0, len(moved), 900):
+            batch = moved[start:start + 900]
+            dates = session.scalars(
+                select(Order.order_date).distinct()
+                .join(OrderItem, OrderItem.order_id == Order.order_id)
+                .where(OrderItem.product_id.in_(batch))
+            )
+            self.touched_dates.update(None if date is None else date.isoformat() for date in dates)
+
+    def refresh_summaries(self, full=False):
+        """重算彙總表：full=True 時全部重算，否則只刪除並重新彙總受影響的日期與顧客"""
+        with self.db_manager.get_db_session() as session:
+            connection = session.connection()
+            if not full:
+                for name, keys in [('touched_dates', self.touched_dates), ('touched_customers', self.touched_customers)]:
+                    connection.exec_driver_sql(f"CREATE TEMP TABLE IF NOT EXISTS {name} (key)")
+                    connection.exec_driver_sql(f"DELETE FROM {name}")
+                    if keys:
+                        connection.exec_driver_sql(f"INSERT INTO {name} (key) VALUES (?)", [(key,) for key in keys])
+            for table, (condition, column, insert) in SUMMARY_REFRESH.items():
+                if full:
+                    connection.exec_driver_sql(f"DELETE FROM {table}")
+                    connection.exec_driver_sql(insert.format(where=''))
+                else:
+                    connection.exec_driver_sql(f"DELETE FROM {table} WHERE {condition.format(column=column)}")
+                    connection.exec_driver_sql(insert.format(where=f"WHERE {condition.format(column=f'o.{column}')}"))
+        print(f"彙總表已更新 ({'完整重算' if full else f'{len(self.touched_dates)} 個日期、{len(self.touched_customers)} 位顧客'})")
+        self.touched_dates.clear()
+        self.touched_customers.clear()
+
+    def _load_categories(self, session, names):
+        # categories 沒有唯一鍵，只補上資料庫中還沒有的名稱
+        category_ids = dict(session.execute(select(Category.name, Category.category_id)).all())
+        missing = [name for name in names if name not in category_ids]
+        if missing:
+            session.execute(Category.__table__.insert(), [{'name': name} for name in missing])
+            category_ids = dict(session.execute(select(Category.name, Category.category_id)).all())
+        return category_ids
+
+    def _upsert(self, session, table, key, frame):
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: statement.excluded[column] for column in frame.columns if column != key}
+        )
+        records = frame.to_dict('records')
+        for start in range(0, len(records), self.batch_size):
+            session.execute(statement, records[start:start + self.batch_size])
+
+    def process(self):
+        loaders = {
+            'orm': self.orm_load,
+            'bulk': self.bulk_load
+        }
+        loader = self.incremental_load if self.incremental else loaders[self.mode]
+        if loader == self.bulk_load:
+            self._seed_keys()
+        self.rows_processed = 0
+        # 彙總表還是空的 (新資料庫，或先前的載入在重算彙總前中斷) 時，載入後完整重算一次
+        with self.db_manager.get_db_session() as session:
+            full_refresh = session.execute(select(DailySales.id).limit(1)).first() is None
+            has_orders = session.execute(select(Order.order_id).limit(1)).first() is not None
+        # 資料表不會重建，已有訂單時寫入的是既有資料，不使用 synchronous=OFF 的 bulk_load
+        load_profile = self.load_profile or ('incremental_load' if has_orders else 'bulk_load')
+
+        def load(prepared):
+            # 主行程是唯一的寫入者，依 chunk 的順序寫入 rejected rows 報告與資料庫
+            lines, rejected = prepared
+            self.write_rejected(rejected)
+            loader(lines)
+            self.rows_processed += len(lines)
+            if self.chunksize is not None:
+                print(f"已寫入 {len(lines)} 筆資料 (累計 {self.rows_processed} 筆)")
+
+        # 子行程整理 chunk；整份讀取時只有一個 chunk，不建立行程池
+        workers = self.workers if self.chunksize is not None else 1
+        with self.db_manager.bulk_load(load_profile):
+            run_pipeline(((chunk,) for chunk in self.iter_chunks()), order_lines, load, workers)
+            self.db_manager.finalize_database()
+            self.refresh_summaries(full=full_refresh)
+
+    def remember_keys(self, records):
+        # 只保留維度的鍵值，讓本 chunk 的 ORM 物件可以被釋放
+        for record in records:
+            if isinstance(record, Customer):
+                self.customer_ids.add(record.customer_id)
+            elif isinstance(record, Category):
+                self.category_ids[record.name] = record.category_id
+            elif isinstance(record, Product):
+                self.product_ids[record.sku] = record.product_id
 
 def main():
-    etl = ETLProcessor("./data/raw/Pakistan Largest Ecommerce Dataset.csv")
+    etl = ETLProcessor("./data/raw/Pakistan Largest Ecommerce Dataset.csv", mode='bulk')
     etl.process()
 
 if __name__ == "__main__":
@@ -1,9 +1,14 @@
+from contextlib import contextmanager
 from .database import DatabaseConnection
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, deferred_indexes=False):
         self.db = DatabaseConnection()
-        self.db.create_tables()
+        self.db.create_tables(deferred_indexes)
+
+    def finalize_database(self):
+        # 載入完成後補建延後的索引並更新統計資訊 (ANALYZE 或 PRAGMA optimize)
+        self.db.create_indexes()
     
     def add_records(self, records):
         session = self.db.get_session()
@@ -14,4 +19,25 @@ class DatabaseManager:
             session.rollback()
             raise e
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+    @contextmanager
+    def get_db_session(self):
+        session = self.db.get_session()
+        try:
+            yield session
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    @contextmanager
+    def bulk_load(self, profile='bulk_load'):
+        # 大量寫入期間切換連線設定，結束後 (含例外) 切回 serve
+        self.db.use_profile(profile)
+        try:
+            yield
+        finally:
+            self.db.use_profile('serve')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -8,7 +8,7 @@ class Customer(Base):
     __tablename__ = 'customers'
     
     customer_id = Column(Integer, primary_key=True)
-    customer_since = Column(String(20))
+    customer_since = Column(Date)
     orders = relationship("Order", back_populates="customer")
 
 class Category(Base):
@@ -22,8 +22,8 @@ class Product(Base):
     __tablename__ = 'products'
     
     product_id = Column(Integer, primary_key=True)
-    sku = Column(String(100), unique=True, nullable=False)
-    category_id = Column(Integer, ForeignKey('categories.category_id'))
+    sku = Column(String(100), unique=True, index=True, nullable=False)
+    category_id = Column(Integer, ForeignKey('categories.category_id'), index=True)
     price = Column(Float, nullable=False)
     
     category = relationship("Category", back_populates="products")
@@ -33,15 +33,18 @@ class Order(Base):
     __tablename__ = 'orders'
     
     order_id = Column(Integer, primary_key=True)
-    increment_id = Column(String(20))
-    customer_id = Column(Integer, ForeignKey('customers.customer_id'))
+    increment_id = Column(String(20), index=True)
+    customer_id = Column(Integer, ForeignKey('customers.customer_id'), index=True)
     status = Column(String(20))
-    created_at = Column(String(20))
+    created_at = Column(DateTime, index=True)
+    order_date = Column(Date, index=True)  # created_at 的日期部分，供每日彙總
+    order_hour = Column(Integer)  # created_at 的小時，供時段分析
     payment_method = Column(String(50))
     grand_total = Column(Float)
     discount_amount = Column(Float, default=0)
     sales_commission_code = Column(String(20))
     bi_status = Column(String(20))
+    row_hash = Column(Integer)  # 該 CSV 行的雜湊，增量載入時以 increment_id 彙總比對
     
     customer = relationship("Customer", back_populates="orders")
     order_items = relationship("OrderItem", back_populates="order")
@@ -50,10 +53,44 @@ class OrderItem(Base):
     __tablename__ = 'order_items'
     
     order_item_id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey('orders.order_id'))
-    product_id = Column(Integer, ForeignKey('products.product_id'))
+    order_id = Column(Integer, ForeignKey('orders.order_id'), index=True)
+    product_id = Column(Integer, ForeignKey('products.product_id'), index=True)
     qty_ordered = Column(Integer, nullable=False)
     price = Column(Float, nullable=False)
+    line_total = Column(Float)  # qty_ordered * price，由 ETL 寫入供營收彙總
     
     order = relationship("Order", back_populates="order_items")
-    product = relationship("Product", back_populates="order_items")
\ No newline at end of file
+    product = relationship("Product", back_populates="order_items")
+
+# 以下為 ETL 維護的彙總表，載入後只重算受影響的日期與顧客，分析時直接讀取
+
+class DailySales(Base):
+    __tablename__ = 'daily_sales'
+
+    id = Column(Integer, primary_key=True)
+    order_date = Column(Date, index=True)
+    payment_method = Column(String(50))
+    status = Column(String(20))
+    order_count = Column(Integer, nullable=False)
+    valued_orders = Column(Integer, nullable=False)  # grand_total 非 NULL 的訂單數，計算平均訂單金額用
+    grand_total = Column(Float)
+
+class DailyCategoryRevenue(Base):
+    __tablename__ = 'daily_category_revenue'
+
+    id = Column(Integer, primary_key=True)
+    order_date = Column(Date, index=True)
+    category_id = Column(Integer, ForeignKey('categories.category_id'))
+    line_count = Column(Integer, nullable=False)
+    qty_ordered = Column(Integer)
+    revenue = Column(Float)
+
+class CustomerTotal(Base):
+    __tablename__ = 'customer_totals'
+
+    customer_id = Column(Integer, ForeignKey('customers.customer_id'), primary_key=True)
+    order_count = Column(Integer, nullable=False)
+    valued_orders = Column(Integer, nullable=False)
+    total_spent = Column(Float, nullable=False)
+    first_order_at = Column(DateTime)
+    last_order_at = Column(DateTime)
@@ -0,0 +1,287 @@
+"""以合成資料量測各專案 ETL 的吞吐量
+
+依固定的亂數種子產生與各 ETL 相同欄位的 CSV (10k / 1M / 10M 筆)，在暫存目錄中以 etl_orchestrator 的子程序
+執行 process()，記錄每秒筆數、峰值 RSS 與資料庫大小，附加到 JSON 歷史紀錄並與同條件的上一次結果比較。
+
+用法 (於專案根目錄執行):
+    python etl_benchmark.py                                  # 全部資料集，10k 筆
+    python etl_benchmark.py --sizes 10k 1m --datasets netflix ecommerce
+    python etl_benchmark.py --sizes 10m --chunksize 500000 --workers 4
+"""
+import argparse
+import ast
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from etl_orchestrator import ROOT, run_jobs
+
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+HISTORY_PATH = os.path.join(ROOT, 'benchmarks', 'history.json')
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+# 產生資料時每次寫入的列數，10M 筆也不需一次放進記憶體
+GENERATE_ROWS = 200_000
+
+def netflix_flags():
+    # 直接讀取 models.py 中的 GENRES / COUNTRIES，不匯入 netflix 的 src 套件 (各專案的套件同名)
+    tree = ast.parse(open(os.path.join(ROOT, 'netflix', 'src', 'database', 'models.py')).read())
+    names = {node.targets[0].id: ast.literal_eval(node.value) for node in tree.body
+             if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) in ('GENRES', 'COUNTRIES')}
+    return names['GENRES'], names['COUNTRIES']
+
+def generate_netflix(rng, start, rows):
+    genres, countries = netflix_flags()
+    ids = np.arange(start, start + rows)
+    missing = lambda rate: rng.random(rows) < rate
+    frame = pd.DataFrame({
+        'title': [f'Title {i}' for i in ids],
+        'type': rng.choice(['movie', 'tv'], rows, p=[0.7, 0.3]),
+        'genres': '',
+        'releaseYear': pd.array(np.where(missing(0.02), None, rng.integers(1920, 2025, rows)), dtype='Int64'),
+        'imdbId': [f'tt{i:08d}' for i in ids],
+        'imdbAverageRating': np.where(missing(0.1), np.nan, rng.integers(10, 100, rows) / 10),
+        'imdbNumVotes': pd.array(np.where(missing(0.1), None, rng.integers(5, 3_000_000, rows)), dtype='Int64'),
+        'availableCountries': ''
+    })
+    # 每部影片平均 2 種類型、在約 20% 的國家上架
+    flags = pd.DataFrame(np.concatenate([
+        rng.random((rows, len(genres))) < 2 / len(genres),
+        rng.random((rows, len(countries))) < 0.2
+    ], axis=1).astype(np.int8), columns=genres + countries)
+    return pd.concat([frame, flags], axis=1)
+
+def generate_supermarket(rng, start, rows):
+    ids = np.arange(start, start + rows)
+    branch = rng.integers(0, 3, rows)
+    unit_price = rng.integers(1000, 10000, rows) / 100
+    quantity = rng.integers(1, 11, rows)
+    cogs = np.round(unit_price * quantity, 2)
+    tax = np.round(cogs * 0.05, 4)
+    return pd.DataFrame({
+        'Invoice ID': [f'{i // 1_000_000 % 1000:03d}-{i // 10_000 % 100:02d}-{i % 10_000:04d}' for i in ids],
+        'Branch': np.array(['A', 'B', 'C'])[branch],
+        'City': np.array(['Yangon', 'Mandalay', 'Naypyitaw'])[branch],
+        'Customer type': rng.choice(['Member', 'Normal'], rows),
+        'Gender': rng.choice(['Female', 'Male'], rows),
+        'Product line': rng.choice(['Health and beauty', 'Electronic accessories', 'Home and lifestyle',
+                                    'Sports and travel', 'Food and beverages', 'Fashion accessories'], rows),
+        'Unit price': unit_price,
+        'Quantity': quantity,
+        'Tax 5%': tax,
+        'Total': np.round(cogs + tax, 4),
+        'Date': [f'{month}/{day}/2019' for month, day in zip(rng.integers(1, 4, rows), rng.integers(1, 29, rows))],
+        'Time': [f'{hour}:{minute:02d}' for hour, minute in zip(rng.integers(10, 21, rows), rng.integers(0, 60, rows))],
+        'Payment': rng.choice(['Ewallet', 'Cash', 'Credit card'], rows),
+        'cogs': cogs,
+        'gross margin percentage': 4.761904762,
+        'gross income': tax,
+        'Rating': rng.integers(40, 101, rows) / 10
+    })
+
+def generate_user_behavior(rng, start, rows):
+    # 沿用 user_behavior 基準測試的產生器；只在產生資料的子程序中匯入 (各專案的套件都叫 src)
+    project = os.path.join(ROOT, 'user_behavior')
+    if project not in sys.path:
+        sys.path.insert(0, project)
+    from src.database.benchmark import generate_frame
+    return generate_frame(rng, start, rows)
+
+def generate_ecommerce(rng, start, rows):
+    # 每筆訂單 (increment_id) 兩行，increment_id 依序遞增，與原始資料相同同一訂單的行相鄰
+    increment_id = 100_000_000 + (start + np.arange(rows)) // 2
+    created_at = pd.Timestamp('2016-07-01') + pd.to_timedelta(rng.integers(0, 790, rows), unit='D')
+    status = rng.choice(['complete', 'canceled', 'received', 'order_refunded', 'refund', 'cod', 'pending'], rows,
+                        p=[0.4, 0.3, 0.1, 0.08, 0.04, 0.04, 0.04])
+    sku = rng.integers(0, 50_000, rows)
+    customer = rng.integers(1, 120_000, rows)
+    categories = np.array(["Men's Fashion", 'Mobiles & Tablets', "Women's Fashion", 'Appliances', 'Superstore',
+                           'Beauty & Grooming', 'Soghaat', 'Others', 'Home & Living', 'Entertainment',
+                           'Health & Sports', 'Kids & Baby', 'Computing', 'School & Education', 'Books', r'\N'])
+    price = rng.integers(1, 500, rows) * 10.0
+    qty = rng.integers(1, 4, rows)
+    frame = pd.DataFrame({
+        'item_id': np.arange(start, start + rows) + 211131,
+        'status': status,
+        'created_at': created_at.strftime('%-m/%-d/%Y'),
+        'sku': [f'SKU-{i:05d}' for i in sku],
+        'price': price,
+        'qty_ordered': qty,
+        'grand_total': price * qty,
+        'increment_id': increment_id.astype(str),
+        'category_name_1': categories[sku % len(categories)],
+        'sales_commission_code': np.where(rng.random(rows) < 0.7, r'\N', 'C-Rud'),
+        'discount_amount': np.where(rng.random(rows) < 0.7, 0.0, rng.integers(1, 300, rows).astype(float)),
+        'payment_method': rng.choice(['cod', 'Payaxis', 'Easypay', 'jazzwallet', 'bankalfalah'], rows),
+        'Working Date': created_at.strftime('%-m/%-d/%Y'),
+        'BI Status': rng.choice(['Net', 'Gross', 'Valid'], rows),
+        ' MV ': (price * qty).astype(int).astype(str),
+        'Year': created_at.year,
+        'Month': created_at.month,
+        'Customer Since': created_at.strftime('%Y-%-m'),
+        'M-Y': created_at.strftime('%-m-%Y'),
+        'FY': 'FY' + (created_at.year % 100 + (created_at.month >= 7)).astype(str),
+        'Customer ID': customer.astype(str)
+    })
+    # 原始資料尾端有 5 個空白欄位
+    for column in range(21, 26):
+        frame[f'Unnamed: {column}'] = np.nan
+    return frame
+
+# 資料集 -> (產生器, 專案目錄, ETL 類別, 資料庫檔案, 預設的 ETL 參數)
+DATASETS = {
+    'netflix': (generate_netflix, 'netflix', 'src.database.etl:NetflixETL', 'netflix.db', {'mode': 'bulk'}),
+    'supermarket': (generate_supermarket, 'supermarket', 'src.database.etl:SuperMarketETL', 'supermarket.db', {}),
+    'user_behavior': (generate_user_behavior, 'user_behavior', 'src.database.etl:UserBehaviorETL', 'user_behavior.db',
+                      {'mode': 'batch'}),
+    'ecommerce': (generate_ecommerce, 'ecommerce', 'src.analytics.etl:ETLProcessor', 'ecommerce.db', {'mode': 'bulk'}),
+}
+
+def generate_dataset(dataset, rows, csv_path, seed=0):
+    """以固定種子分段產生合成資料；相同的資料集、筆數與種子產生相同的 CSV"""
+    generate = DATASETS[dataset][0]
+    rng = np.random.default_rng(seed)
+    tmp_path = f'{csv_path}.tmp'
+    for start in range(0, rows, GENERATE_ROWS):
+        frame = generate(rng, start, min(GENERATE_ROWS, rows - start))
+        frame.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(tmp_path, csv_path)
+
+def dataset_path(dataset, rows, seed, data_dir=DATA_DIR):
+    """產生過的 CSV 留在 data_dir 中重複使用"""
+    csv_path = os.path.join(data_dir, f'{dataset}-{rows}-seed{seed}.csv')
+    if not os.path.exists(csv_path):
+        os.makedirs(data_dir, exist_ok=True)
+        start = time.perf_counter()
+        # 在子程序中產生，基準測試的主程序不保留產生資料時的記憶體
+        process = multiprocessing.Process(target=generate_dataset, args=(dataset, rows, csv_path, seed))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"產生 {dataset} 合成資料失敗 (結束代碼 {process.exitcode})")
+        print(f"已產生 {csv_path} ({os.path.getsize(csv_path) / 2**20:.1f} MB，{time.perf_counter() - start:.1f} 秒)")
+    return csv_path
+
+def database_size_mb(workdir, db_name):
+    # 含尚未 checkpoint 的 WAL 檔
+    paths = [os.path.join(workdir, db_name + suffix) for suffix in ('', '-wal')]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path)) / 2**20
+
+def run_benchmark(dataset, rows, seed=0, etl_kwargs=None, data_dir=DATA_DIR):
+    """在暫存目錄中執行一次 ETL，回傳一筆歷史紀錄"""
+    _, project, target, db_name, defaults = DATASETS[dataset]
+    csv_path = os.path.abspath(dataset_path(dataset, rows, seed, data_dir))
+    # 預設不使用 Parquet 快取，每次都量測解析 CSV 的成本
+    kwargs = {**defaults, 'raw_cache_dir': None, **(etl_kwargs or {})}
+    with tempfile.TemporaryDirectory(prefix=f'etl-benchmark-{dataset}-') as workdir:
+        spec = dict(project=project, workdir=workdir, target=target, args=[csv_path], kwargs=kwargs)
+        result = run_jobs(jobs={dataset: spec}, log_dir=os.path.join(workdir, 'logs'))[dataset]
+        if result['status'] != 'ok':
+            print(open(os.path.join(workdir, 'logs', f'{dataset}.log')).read()[-2000:])
+        db_size = database_size_mb(workdir, db_name)
+
+    # 被訊號終止或 timeout 的工作沒有 seconds
+    seconds = result.get('seconds')
+    ok = result['status'] == 'ok'
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_revision(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'dataset': dataset,
+        'rows': rows,
+        'seed': seed,
+        'options': kwargs,
+        'status': result['status'],
+        'error': result.get('error'),
+        'seconds': seconds,
+        'rows_per_sec': result['rows'] / seconds if ok and seconds and result['rows'] is not None else None,
+        'peak_rss_mb': result.get('peak_rss_mb'),
+        'db_size_mb': db_size if ok else None
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def save_history(history, path=HISTORY_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+
+def previous_record(history, record):
+    """同資料集、筆數、種子與 ETL 參數的上一次成功紀錄"""
+    for entry in reversed(history):
+        if entry['status'] == 'ok' and all(entry[key] == record[key] for key in ('dataset', 'rows', 'seed', 'options')):
+            return entry
+    return None
+
+def print_report(records, history, threshold):
+    print("\n=== ETL 基準測試 ===")
+    # 中文字佔兩格寬，標題的欄寬扣掉中文字數才能與資料列對齊
+    print(f"{'資料集':<13}{'筆數':>10}{'耗時 (秒)':>9}{'每秒筆數':>10}{'峰值 RSS (MB)':>14}{'資料庫 (MB)':>11}  與上次比較")
+    for record in records:
+        if record['status'] != 'ok':
+            print(f"{record['dataset']:<16}{record['rows']:>12,}  {record['status']}: {record['error']}")
+            continue
+        previous = previous_record(history, record)
+        if previous is None:
+            change = '無紀錄'
+        else:
+            speed = record['rows_per_sec'] / previous['rows_per_sec'] - 1
+            memory = record['peak_rss_mb'] / previous['peak_rss_mb'] - 1
+            change = f"每秒筆數 {speed:+.1%}，RSS {memory:+.1%} (vs {previous['commit']})"
+            if speed < -threshold:
+                change += '  <- 退步'
+        print(f"{record['dataset']:<16}{record['rows']:>12,}{record['seconds']:>12.2f}{record['rows_per_sec']:>14,.0f}"
+              f"{record['peak_rss_mb']:>16.1f}{record['db_size_mb']:>14.1f}  {change}")
+
+def parse_size(value):
+    if value.lower() in SIZES:
+        return SIZES[value.lower()]
+    return int(value)
+
+def main():
+    parser = argparse.ArgumentParser(description='以合成資料量測各專案 ETL 的吞吐量')
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[SIZES['10k']],
+                        help=f'資料筆數，可用 {", ".join(SIZES)} 或整數')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=None, help='以串流模式逐塊載入，大資料量時限制記憶體用量')
+    parser.add_argument('--workers', type=int, default=None, help='串流模式下平行轉換 chunk 的子行程數')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='合成 CSV 的存放目錄 (產生過的檔案會重複使用)')
+    parser.add_argument('--history', default=HISTORY_PATH, help='JSON 歷史紀錄檔')
+    parser.add_argument('--threshold', type=float, default=0.1, help='每秒筆數下降超過此比例時標示為退步')
+    args = parser.parse_args()
+
+    etl_kwargs = {name: value for name, value in [('chunksize', args.chunksize), ('workers', args.workers)]
+                  if value is not None}
+    history = load_history(args.history)
+    records = []
+    for rows in args.sizes:
+        for dataset in args.datasets:
+            print(f"執行 {dataset} ({rows:,} 筆)...")
+            records.append(run_benchmark(dataset, rows, args.seed, etl_kwargs, args.data_dir))
+            # 每筆結果完成後立即寫入，後續的測試中斷也不會遺失已完成的紀錄
+            save_history(history + records, args.history)
+
+    print_report(records, history, args.threshold)
+    print(f"\n結果已附加至 {args.history}")
+
+if __name__ == "__main__":
+    main()
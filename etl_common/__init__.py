@@ -0,0 +1 @@
+"""各專案 ETL 共用的模組：raw_cache (CSV 原始資料的 Parquet 快取) 與 pipeline (多行程轉換、單一寫入者的管線)"""
@@ -0,0 +1,54 @@
+"""多行程轉換、單一寫入者的 ETL 管線
+
+SQLite 同一時間只允許一個寫入者，但每個 chunk 的清理、欄位與外鍵對應、雜湊只依賴 chunk 本身。
+run_pipeline 以行程池平行轉換 chunk，呼叫端 (主行程) 是唯一的寫入者，依 chunk 的順序寫入資料庫。
+"""
+import collections
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+def run_pipeline(tasks, transform, load, workers=1, max_pending=None):
+    """以 transform(*task) 轉換每個 task，結果依 tasks 的順序交給 load 寫入
+
+    tasks 在主行程中逐一產生，可以在此時寫入維度資料、取得外鍵對照表；transform 必須是模組層級的函式
+    (可被 pickle) 且只依賴參數，在子行程中執行；load 只在主行程中執行，是唯一寫入資料庫的地方。
+    轉換中與等待寫入的 chunk 最多 max_pending 個 (預設為 workers 的兩倍)，寫入跟不上時暫停讀取新的 chunk，
+    記憶體用量不隨檔案大小成長。workers <= 1 時不建立行程池，在主行程依序轉換與寫入。
+    """
+    waited = written = 0.0
+    pending = collections.deque()
+
+    def drain():
+        nonlocal waited, written
+        start = time.perf_counter()
+        result = pending.popleft().result()
+        waited += time.perf_counter() - start
+        start = time.perf_counter()
+        load(result)
+        written += time.perf_counter() - start
+
+    if workers <= 1:
+        for task in tasks:
+            start = time.perf_counter()
+            result = transform(*task)
+            waited += time.perf_counter() - start
+            start = time.perf_counter()
+            load(result)
+            written += time.perf_counter() - start
+    else:
+        max_pending = max_pending or workers * 2
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                for task in tasks:
+                    pending.append(executor.submit(transform, *task))
+                    if len(pending) >= max_pending:
+                        drain()
+                while pending:
+                    drain()
+            except BaseException:
+                # 寫入或轉換失敗時取消尚未開始的 chunk，不再繼續轉換
+                for future in pending:
+                    future.cancel()
+                raise
+    logging.info(f"管線 (workers={workers}): 轉換或等待轉換 {waited:.2f} 秒，寫入 {written:.2f} 秒")
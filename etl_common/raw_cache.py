@@ -0,0 +1,152 @@
+"""CSV 原始資料的 Parquet 快取
+
+第一次讀取時以相同的 read_csv 參數解析 CSV 並轉存成 Parquet，之後同一個檔案
+(路徑、大小、修改時間相同) 搭配相同參數的讀取直接讀 Parquet，不再解析文字。
+
+各專案經由 src 套件中的 common 模組使用 (該模組負責把 repo 根目錄加入 sys.path)，notebook 中也可以直接使用:
+    from src.database.common import raw_cache
+    df = raw_cache.read_csv('./data/raw/supermarket_sales.csv', usecols=['Invoice ID', 'Total'])
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+CACHE_DIR = './data/cache'
+# 轉換時每次解析的 CSV 列數，每塊各存成一個 Parquet 檔以限制記憶體用量
+PART_ROWS = 1_000_000
+# 只選擇解析器、不影響結果的 read_csv 參數
+PARSER_OPTIONS = ('engine', 'low_memory')
+# pd.read_csv 預設視為缺值的字串
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+def cache_options(read_options):
+    """列入快取鍵值的 read_csv 參數：只選擇解析器、不影響結果的參數不列入
+
+    pyarrow 引擎以最接近的值解析浮點數，與 C 引擎的 float_precision='round_trip' 結果相同，
+    ETL 的整份讀取 (pyarrow) 與串流讀取 (C 引擎) 因此共用同一份快取。
+    """
+    options = {key: value for key, value in read_options.items() if key not in PARSER_OPTIONS}
+    if read_options.get('engine') == 'pyarrow':
+        options.setdefault('float_precision', 'round_trip')
+    return options
+
+def cache_path(csv_path, read_options, cache_dir=CACHE_DIR):
+    """快取目錄：同一個 CSV 以路徑雜湊區分，版本由檔案大小與修改時間決定，鍵值由 read_csv 參數決定"""
+    stat = os.stat(csv_path)
+    source = os.path.abspath(csv_path)
+    version = hashlib.sha256(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:8]
+    key = hashlib.sha256(json.dumps(cache_options(read_options), sort_keys=True, default=str).encode()).hexdigest()[:16]
+    stem = f"{os.path.splitext(os.path.basename(csv_path))[0]}-{hashlib.sha256(source.encode()).hexdigest()[:8]}"
+    return os.path.join(cache_dir, stem), version, key
+
+def parse_csv(csv_path, **read_options):
+    """pd.read_csv；pyarrow 引擎下的結果 (欄位順序、str 欄位內容) 與 C 引擎一致"""
+    options = {key: value for key, value in read_options.items() if key != 'engine'}
+    dtype = dict(options.pop('dtype', None) or {})
+    usecols = options.pop('usecols', None)
+    if read_options.get('engine') != 'pyarrow' or options:
+        return pd.read_csv(csv_path, **read_options)
+
+    # pd.read_csv 的 pyarrow 引擎先推斷型別、讀完才套用 dtype，str 欄位會是推斷後的文字
+    # (100000 -> '100000.0'、13:08 -> '13:08:00.000000')；改請 pyarrow 直接把這些欄位讀成字串
+    text = [column for column, value in dtype.items() if value is str]
+    table = pa_csv.read_csv(csv_path, convert_options=pa_csv.ConvertOptions(
+        column_types={column: pa.string() for column in text}, include_columns=usecols,
+        null_values=NA_VALUES, strings_can_be_null=True))
+    # 與 read_csv 相同，整欄缺值的欄位為 float64
+    schema = table.schema
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.float64()))
+    frame = table.cast(schema).to_pandas()
+    for column in text:
+        if column in frame:
+            frame[column] = frame[column].where(frame[column].notna(), np.nan)
+    frame = frame.astype({column: value for column, value in dtype.items() if value is not str and column in frame})
+    # usecols 時 pyarrow 依 usecols 的順序回傳，改回 CSV 中的欄位順序
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return frame[[column for column in header if column in frame]]
+
+def build_cache(csv_path, path, read_options):
+    # 先寫到暫存目錄再改名，轉換中斷時不會留下不完整的快取
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    if read_options.get('engine') == 'pyarrow':
+        # pyarrow 引擎不支援 chunksize，整份解析後存成單一檔案
+        chunks = [parse_csv(csv_path, **read_options)]
+    else:
+        chunks = pd.read_csv(csv_path, chunksize=PART_ROWS, **read_options)
+    parts = 0
+    for parts, chunk in enumerate(chunks, start=1):
+        chunk.to_parquet(os.path.join(tmp_path, f'part-{parts:05d}.parquet'), index=False)
+    if parts == 0:
+        pd.read_csv(csv_path, nrows=0, **read_options).to_parquet(os.path.join(tmp_path, 'part-00000.parquet'), index=False)
+    os.replace(tmp_path, path)
+
+def read_csv(csv_path, chunksize=None, cache_dir=CACHE_DIR, **read_options):
+    """與 pd.read_csv 相同的結果，改由 Parquet 快取提供；usecols 在讀取 Parquet 時做欄位投影
+
+    cache_dir 為 None 時直接讀取 CSV。
+    """
+    if cache_dir is None:
+        if chunksize is not None:
+            return pd.read_csv(csv_path, chunksize=chunksize, **read_options)
+        return parse_csv(csv_path, **read_options)
+
+    # 快取保存全部欄位，usecols 不同的讀取可以共用同一份快取
+    usecols = read_options.pop('usecols', None)
+    stem, version, key = cache_path(csv_path, read_options, cache_dir)
+    path = f'{stem}-{version}-{key}'
+    if not os.path.isdir(path):
+        start = time.perf_counter()
+        os.makedirs(cache_dir, exist_ok=True)
+        # 只移除來源檔案已變動 (大小或修改時間不同) 的舊快取，其他 read_csv 參數的快取保留
+        for stale in glob.glob(f'{glob.escape(stem)}-*'):
+            if not stale.startswith(f'{stem}-{version}-'):
+                shutil.rmtree(stale, ignore_errors=True)
+        build_cache(csv_path, path, read_options)
+        logging.info(f'已將 {csv_path} 轉存為 Parquet 快取，耗時 {time.perf_counter() - start:.2f} 秒: {path}')
+
+    parts = sorted(glob.glob(os.path.join(glob.escape(path), 'part-*.parquet')))
+    columns = None
+    if usecols is not None:
+        # 與 read_csv 相同，依 CSV 中的欄位順序回傳
+        wanted = set(usecols)
+        columns = [name for name in pq.read_schema(parts[0]).names if name in wanted]
+    if chunksize is None:
+        frames = [pd.read_parquet(part, columns=columns) for part in parts]
+        if len(frames) == 1:
+            return restore_missing(frames[0])
+        # 串流讀取建立的快取有多個 Parquet 檔，各檔的類別不同時 concat 會退回 object，合併後轉回 category
+        categories = frames[0].columns[frames[0].dtypes == 'category']
+        frame = pd.concat(frames, ignore_index=True)
+        frame[categories] = frame[categories].astype('category')
+        return restore_missing(frame)
+    return iter_parts(parts, columns, chunksize)
+
+def iter_parts(parts, columns, chunksize):
+    # 與 read_csv 的 chunksize 相同，索引跨 chunk 連續
+    offset = 0
+    for part in parts:
+        for batch in pq.ParquetFile(part).iter_batches(batch_size=chunksize, columns=columns):
+            frame = restore_missing(batch.to_pandas())
+            frame.index = pd.RangeIndex(offset, offset + len(frame))
+            offset += len(frame)
+            yield frame
+
+def restore_missing(frame):
+    # Parquet 讀回的文字欄位以 None 表示缺值，改回 read_csv 的 NaN
+    for column in frame.columns[frame.dtypes == object]:
+        frame[column] = frame[column].where(frame[column].notna(), np.nan)
+    return frame
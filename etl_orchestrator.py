@@ -0,0 +1,250 @@
+"""同時執行各專案的 ETL
+
+四個專案各自寫入自己的 SQLite 檔案 (netflix.db、supermarket.db ...)，彼此不共用資料庫，因此每個工作在
+獨立的子程序中同時執行 (各專案的套件都叫 src，也無法在同一個程序中匯入)。工作只在 after 列出的工作
+都成功後才啟動，整體耗時約為最久的一條相依鏈，而不是所有工作的總和。
+
+用法 (於專案根目錄執行):
+    python etl_orchestrator.py                        # 執行 JOBS 中的全部工作
+    python etl_orchestrator.py netflix ecommerce_eda  # 只執行指定的工作 (連同其相依的工作)
+    python etl_orchestrator.py --max-parallel 2 --timeout 3600 --summary ./logs/etl/summary.json
+"""
+import argparse
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+import traceback
+from multiprocessing.connection import wait
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(ROOT, 'logs', 'etl')
+
+# 工作名稱 -> 設定，未指定的欄位沿用 JOB_DEFAULTS
+#   project: 專案目錄，作為工作的匯入路徑
+#   workdir: 工作的 cwd (資料庫與相對路徑都以此為準)，None 表示專案目錄
+#   target: 'module:attr'；attr 為類別時以 args / kwargs 建立後呼叫 process()，為函式時以 argv 為命令列參數呼叫
+#   after: 必須先成功完成的工作
+#   memory_mb / cpu_seconds: 子程序的位址空間與 CPU 時間上限 (RLIMIT_AS / RLIMIT_CPU)，None 表示不限制
+#   timeout: 執行時間上限 (秒)，超過時終止子程序
+JOBS = {
+    'netflix': dict(project='netflix', target='src.database.etl:NetflixETL',
+                    args=['./data/netflix_processed.csv'], kwargs={'mode': 'bulk'}),
+    'supermarket': dict(project='supermarket', target='src.database.etl:SuperMarketETL',
+                        args=['./data/raw/supermarket_sales.csv']),
+    'user_behavior': dict(project='user_behavior', target='src.database.etl:UserBehaviorETL',
+                          args=['./data/user_behavior_dataset.csv'], kwargs={'mode': 'batch'}),
+    'ecommerce': dict(project='ecommerce', target='src.analytics.etl:ETLProcessor',
+                      args=['./data/raw/Pakistan Largest Ecommerce Dataset.csv'], kwargs={'mode': 'bulk'}),
+    # 分析報表讀取 ETL 寫入的 ecommerce.db 與彙總表
+    'ecommerce_eda': dict(project='ecommerce', target='src.analytics.eda:main', after=['ecommerce']),
+}
+JOB_DEFAULTS = dict(workdir=None, args=[], kwargs={}, argv=[], after=[], memory_mb=None, cpu_seconds=None, timeout=None)
+
+def plan_jobs(names=None, jobs=JOBS):
+    """展開相依的工作並檢查設定，依相依順序回傳 {工作名稱: 完整設定}"""
+    names = list(jobs) if not names else names
+    ordered = {}
+    visiting = set()
+
+    def visit(name):
+        if name in ordered:
+            return
+        if name not in jobs:
+            raise ValueError(f"未知的工作: {name}，可用工作: {list(jobs)}")
+        if name in visiting:
+            raise ValueError(f"工作的相依關係有循環: {name}")
+        visiting.add(name)
+        spec = {**JOB_DEFAULTS, **jobs[name]}
+        for dependency in spec['after']:
+            visit(dependency)
+        visiting.discard(name)
+        ordered[name] = spec
+
+    for name in names:
+        visit(name)
+    return ordered
+
+def peak_rss_mb():
+    # 本程序與已結束子程序 (ETL 的轉換行程池) 中最大的 RSS；ru_maxrss 在 Linux 以 KB、macOS 以 bytes 為單位
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    if os.path.exists('/proc/self/status'):
+        # exec 後的 ru_maxrss 仍保留 spawn 前父程序的峰值，Linux 改讀本程序自己的 VmHWM (KB)
+        with open('/proc/self/status') as f:
+            peak = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:')) / 2**10
+    return max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+def run_job(spec, log_path, conn):
+    """子程序：切換到工作目錄、套用資源上限後執行工作，將結果傳回主程序"""
+    # 獨立的程序群組，timeout 時連同 ETL 的轉換行程池一起終止
+    os.setpgrp()
+    project = os.path.join(ROOT, spec['project'])
+    os.chdir(os.path.join(ROOT, spec['workdir'] or project))
+    sys.path.insert(0, project)
+    if spec['memory_mb'] is not None:
+        limit = spec['memory_mb'] * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if spec['cpu_seconds'] is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (spec['cpu_seconds'], spec['cpu_seconds']))
+
+    # 同時執行的工作輸出各自寫入自己的 log 檔，不在終端機交錯
+    with open(log_path, 'w') as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+    result = {'rows': None, 'seconds': None}
+    try:
+        module, attr = spec['target'].split(':')
+        target = getattr(importlib.import_module(module), attr)
+        start = time.perf_counter()
+        if inspect.isclass(target):
+            etl = target(*spec['args'], **spec['kwargs'])
+            etl.process()
+            result['rows'] = getattr(etl, 'rows_processed', None)
+        else:
+            sys.argv = [spec['target'], *spec['argv']]
+            target()
+        # 不含程序啟動與匯入，只計算執行工作本身的時間
+        result['seconds'] = time.perf_counter() - start
+        result['status'] = 'ok'
+    except BaseException as e:
+        # 包含 MemoryError 與 argparse 的 SystemExit
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    result['peak_rss_mb'] = peak_rss_mb()
+    conn.send(result)
+    conn.close()
+
+def run_jobs(names=None, max_parallel=None, log_dir=LOG_DIR, jobs=JOBS):
+    """依相依順序同時執行工作，回傳 {工作名稱: 執行結果}
+
+    相依的工作失敗時略過後續工作；max_parallel 為同時執行的工作數上限，None 表示不限制。
+    工作以 spawn 的子程序執行，呼叫端的主模組需以 if __name__ == "__main__" 保護。
+    """
+    if max_parallel is not None and max_parallel < 1:
+        raise ValueError(f"max_parallel 必須大於 0: {max_parallel}")
+    specs = plan_jobs(names, jobs)
+    os.makedirs(log_dir, exist_ok=True)
+    waiting = list(specs)
+    running = {}
+    results = {}
+    # 以 spawn 建立子程序：fork 會繼承主程序已使用的記憶體，峰值 RSS 只應反映工作本身
+    context = multiprocessing.get_context('spawn')
+
+    def finish(name, result):
+        process, conn, start = running.pop(name)
+        result['duration'] = time.perf_counter() - start
+        results[name] = result
+        conn.close()
+        print(f"[{name}] {result['status']} ({result['duration']:.1f} 秒)"
+              + (f": {result['error']}" if 'error' in result else ''))
+
+    def kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # 子程序還沒建立自己的程序群組
+            process.kill()
+        process.join()
+
+    try:
+        while waiting or running:
+            # 啟動相依工作都已成功的工作；相依工作失敗則略過
+            for name in list(waiting):
+                spec = specs[name]
+                statuses = [results[dependency]['status'] if dependency in results else None for dependency in spec['after']]
+                if any(status not in (None, 'ok') for status in statuses):
+                    waiting.remove(name)
+                    results[name] = {'status': 'skipped', 'rows': None, 'duration': 0.0, 'peak_rss_mb': None,
+                                     'error': f"相依的工作未成功: {spec['after']}"}
+                    print(f"[{name}] skipped: {results[name]['error']}")
+                elif None not in statuses and (max_parallel is None or len(running) < max_parallel):
+                    waiting.remove(name)
+                    receiver, sender = context.Pipe(duplex=False)
+                    log_path = os.path.join(log_dir, f'{name}.log')
+                    process = context.Process(target=run_job, args=(spec, log_path, sender), name=f'etl-{name}')
+                    process.start()
+                    sender.close()
+                    running[name] = (process, receiver, time.perf_counter())
+                    print(f"[{name}] 開始執行，log: {log_path}")
+            if not running:
+                continue
+
+            # 等到有工作結束或最近的 timeout 到期
+            now = time.perf_counter()
+            deadlines = [start + specs[name]['timeout'] - now
+                         for name, (_, _, start) in running.items() if specs[name]['timeout'] is not None]
+            wait([process.sentinel for process, _, _ in running.values()], timeout=max(min(deadlines), 0) if deadlines else None)
+
+            for name, (process, conn, start) in list(running.items()):
+                timeout = specs[name]['timeout']
+                if process.is_alive():
+                    if timeout is not None and time.perf_counter() - start >= timeout:
+                        kill(process)
+                        finish(name, {'status': 'timeout', 'rows': None, 'peak_rss_mb': None,
+                                      'error': f"超過 {timeout} 秒的執行時間上限"})
+                    continue
+                try:
+                    result = conn.recv()
+                except EOFError:
+                    # 未回傳結果即結束：被訊號終止 (例如超過 RLIMIT_CPU 的 SIGXCPU) 或在啟動階段失敗
+                    exitcode = process.exitcode
+                    reason = f"被訊號 {signal.Signals(-exitcode).name} 終止" if exitcode < 0 else f"結束代碼 {exitcode}"
+                    result = {'status': 'failed', 'rows': None, 'peak_rss_mb': None, 'error': f"子程序未回傳結果，{reason}"}
+                process.join()
+                finish(name, result)
+    except KeyboardInterrupt:
+        for process, _, _ in running.values():
+            kill(process)
+        raise
+    # 依相依順序回傳
+    return {name: results[name] for name in specs}
+
+def print_summary(results, elapsed):
+    print("\n=== ETL 執行摘要 ===")
+    # 中文字佔兩格寬，標題的欄寬扣掉中文字數才能與資料列對齊
+    print(f"{'工作':<14}{'狀態':<8}{'筆數':>10}{'耗時 (秒)':>9}{'峰值 RSS (MB)':>14}")
+    for name, result in results.items():
+        rows = '-' if result['rows'] is None else f"{result['rows']:,}"
+        rss = '-' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.1f}"
+        print(f"{name:<16}{result['status']:<10}{rows:>12}{result['duration']:>12.1f}{rss:>16}")
+    total = sum(result['duration'] for result in results.values())
+    print(f"總耗時 {elapsed:.1f} 秒 (各工作耗時合計 {total:.1f} 秒)")
+
+def main():
+    parser = argparse.ArgumentParser(description='同時執行各專案的 ETL')
+    parser.add_argument('jobs', nargs='*', help=f'要執行的工作 (預設全部): {", ".join(JOBS)}')
+    parser.add_argument('--max-parallel', type=int, default=None, help='同時執行的工作數上限，預設不限制')
+    parser.add_argument('--timeout', type=float, default=None, help='未設定 timeout 的工作的執行時間上限 (秒)')
+    parser.add_argument('--memory-mb', type=int, default=None, help='未設定 memory_mb 的工作的位址空間上限 (MB)')
+    parser.add_argument('--log-dir', default=LOG_DIR, help='各工作輸出的 log 目錄')
+    parser.add_argument('--summary', default=None, help='將執行摘要另存成 JSON 檔')
+    args = parser.parse_args()
+
+    jobs = {name: {'timeout': args.timeout, 'memory_mb': args.memory_mb, **spec} for name, spec in JOBS.items()}
+    start = time.perf_counter()
+    try:
+        results = run_jobs(args.jobs, args.max_parallel, args.log_dir, jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+    print_summary(results, elapsed)
+    if args.summary:
+        os.makedirs(os.path.dirname(os.path.abspath(args.summary)), exist_ok=True)
+        with open(args.summary, 'w') as f:
+            json.dump({'elapsed': elapsed, 'jobs': results}, f, ensure_ascii=False, indent=2)
+    sys.exit(0 if all(result['status'] == 'ok' for result in results.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,19 @@ class DatabaseManager:
     def __init__(self):
         self.db= DatabaseConnection()
 
-    def initialize_database(self):
+    def initialize_database(self, reset=True, deferred_indexes=False):
+        # reset=False 時保留既有資料，供增量載入使用
         try:
-            self.db._delete_tables()
-            self.db._create_tables()
+            if reset:
+                self.db._delete_tables()
+            self.db._create_tables(deferred_indexes)
+        except Exception as e:
+            raise Exception(str(e))
+
+    def finalize_database(self):
+        # 載入完成後補建延後的索引並更新統計資訊 (ANALYZE 或 PRAGMA optimize)
+        try:
+            self.db._create_indexes()
         except Exception as e:
             raise Exception(str(e))
         
@@ -25,6 +34,15 @@ class DatabaseManager:
         finally:
             session.close()
     
+    @contextmanager
+    def bulk_load(self, profile='bulk_load'):
+        # 大量寫入期間切換連線設定，結束後 (含例外) 切回 serve
+        self.db.use_profile(profile)
+        try:
+            yield
+        finally:
+            self.db.use_profile('serve')
+
     def execute_transaction(self, operation):
         with self.get_db_session() as session:
             return operation(session)
@@ -1,39 +1,140 @@
 import logging
+import time
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from .models import Type, Movie
+from sqlalchemy import select, func
+from .models import Base, Type, Movie, Title, Genre, Country, MovieGenre, MovieCountry, GENRES, COUNTRIES, flag_column
 from .database_manager import DatabaseManager
+from .flags import pack_flags
+from .common import raw_cache, run_pipeline
 
 logging.basicConfig(
     level=logging.INFO
 )
 
+LOAD_MODES = ('orm', 'bulk', 'normalized', 'bitmask')
+
+# CSV 欄位 -> movies / titles 資料表欄位
+BASE_COLUMNS = {
+    'imdbId': 'imdb_id',
+    'title': 'title',
+    'releaseYear': 'release_year',
+    'imdbAverageRating': 'imdb_average_rating',
+    'imdbNumVotes': 'imdb_num_votes',
+}
+COLUMN_MAPPING = {
+    **BASE_COLUMNS,
+    **{name: flag_column(name) for name in GENRES + COUNTRIES}
+}
+
+# ETL 實際用到的 CSV 欄位 (對應到資料表欄位與 type)，其餘欄位不解析
+CSV_COLUMNS = ['type', *COLUMN_MAPPING]
+
+def row_hash(frame):
+    """每列內容的 64 位元雜湊，增量載入時用來略過未變動的資料"""
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+def movie_rows(chunk, type_ids):
+    """chunk 轉成 movies 資料表的 DataFrame；每種載入模式都寫入 row_hash，之後的增量載入才能略過未變動的資料"""
+    movies = chunk[list(COLUMN_MAPPING)].rename(columns=COLUMN_MAPPING)
+    movies['type_id'] = chunk['type'].map(type_ids)
+    movies['row_hash'] = row_hash(movies)
+    return movies
+
+def build_tables(chunk, stage, keys):
+    """將 chunk 轉成各資料表可直接寫入的 DataFrame (資料表名稱 -> DataFrame)
+
+    外鍵以寫入端 resolve_keys 產生的 keys 對應，不存取資料庫，由管線在子行程中執行。
+    """
+    if stage in ('bulk', 'incremental'):
+        # 一次完成欄位對應，不建立 ORM 物件
+        return {Movie.__tablename__: movie_rows(chunk, keys['type_ids'])}
+
+    title_ids = np.arange(keys['first_title_id'], keys['first_title_id'] + len(chunk))
+    titles = chunk[list(BASE_COLUMNS)].rename(columns=BASE_COLUMNS)
+    titles.insert(0, 'id', title_ids)
+    titles['type_id'] = chunk['type'].map(keys['type_ids'])
+    titles['genre_mask'] = pack_flags(chunk[GENRES].fillna(0).to_numpy(dtype=bool))[:, 0]
+    country_masks = pack_flags(chunk[COUNTRIES].fillna(0).to_numpy(dtype=bool))
+    for word in range(country_masks.shape[1]):
+        titles[f'country_mask_{word}'] = country_masks[:, word]
+    tables = {Title.__tablename__: titles}
+    if stage == 'normalized':
+        tables[MovieGenre.__tablename__] = melt_flags(chunk, title_ids, GENRES, keys['genre_ids'], 'genre_id')
+        tables[MovieCountry.__tablename__] = melt_flags(chunk, title_ids, COUNTRIES, keys['country_ids'], 'country_id')
+    return tables
+
+def melt_flags(chunk, title_ids, columns, ids, id_column):
+    # 將 one-hot 欄位 melt 成 (title id, 維度 id) 配對，只保留為真的組合
+    flags = chunk[columns].fillna(0).to_numpy(dtype=bool)
+    rows, cols = np.nonzero(flags)
+    dimension_ids = np.array([ids[name] for name in columns])
+    return pd.DataFrame({
+        'title_id': title_ids[rows],
+        id_column: dimension_ids[cols]
+    })
+
 class NetflixETL:
-    def __init__(self, csv_path):
+    def __init__(self, csv_path, mode='orm', batch_size=5000, chunksize=None, incremental=False, load_profile=None, defer_indexes=True,
+                 raw_cache_dir=raw_cache.CACHE_DIR, engine='pyarrow', workers=1):
         logging.info(f"Start ETL, csv Path: {csv_path}")
-        try:
-            self.df = pd.read_csv(
-                csv_path,
-                low_memory=False,
-                dtype = {
-                    'releaseYear': 'Int64',
-                    'imdbNumVotes': 'Int64'
-                }
-            )
-            logging.info(f"load {len(self.df)} rows from csv")
-        except Exception as e:
-            logging.error(f'Fail to load csv: {e}')
+        if mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode: {mode}, expected one of {LOAD_MODES}")
+        if incremental and mode != 'bulk':
+            raise ValueError("Incremental loading upserts into the movies table and requires mode='bulk'")
+        self.mode = mode
+        self.incremental = incremental
+        # synchronous=OFF 的 bulk_load 只用於重建資料表；增量載入寫入保留的既有資料，改用 incremental_load
+        self.load_profile = load_profile or ('incremental_load' if incremental else 'bulk_load')
+        self.batch_size = batch_size
+        self.csv_path = csv_path
+        self.chunksize = chunksize
+        # 串流模式下平行轉換 chunk 的子行程數，1 表示在主行程依序轉換
+        self.workers = workers
+        # CSV 轉存的 Parquet 快取目錄，None 時每次都解析 CSV
+        self.raw_cache_dir = raw_cache_dir
+        self.read_options = dict(
+            usecols=CSV_COLUMNS,
+            dtype = {
+                'type': 'category',
+                'releaseYear': 'Int64',
+                'imdbNumVotes': 'Int64'
+            }
+        )
+        # pyarrow 引擎以多執行緒解析整份檔案，但不支援 chunksize，串流模式沿用 C 引擎
+        if engine == 'pyarrow' and chunksize is None:
+            self.read_options['engine'] = 'pyarrow'
+        else:
+            # C 引擎預設的浮點數解析不一定取最接近的值，改用 round_trip 與 pyarrow 一致，
+            # 整份與串流讀取的數值 (與 row_hash) 才會相同
+            self.read_options['low_memory'] = False
+            self.read_options['float_precision'] = 'round_trip'
+        self.df = None
+        self.rows_processed = 0
+        self.next_title_id = None
+
+        # 串流模式下延後到 process() 才逐塊讀取
+        if chunksize is None:
+            try:
+                start = time.perf_counter()
+                self.df = raw_cache.read_csv(csv_path, cache_dir=raw_cache_dir, **self.read_options)
+                memory = self.df.memory_usage(deep=True).sum() / 2**20
+                logging.info(f"load {len(self.df)} rows from csv in {time.perf_counter() - start:.2f}s ({memory:.1f} MB)")
+            except Exception as e:
+                logging.error(f'Fail to load csv: {e}')
 
         self.db_manager = DatabaseManager()
-        self.db_manager.initialize_database()
+        # 增量載入的 upsert 依賴 unique 索引，只有整批重建時才延後建立索引
+        self.db_manager.initialize_database(reset=not incremental, deferred_indexes=defer_indexes and not incremental)
     
     def transform_data(self):
         logging.info('Start transforming data from csv to SQLite...')
         with self.db_manager.get_db_session() as session:
 
             try:
-                # Types
-                types = {}
+                # Types (串流模式下沿用先前 chunk 已寫入的類型)
+                types = {t.type: t for t in session.query(Type).all()}
                 for _, row in self.df.iterrows():
                     if row['type'] not in types:
                         type = Type(
@@ -44,11 +145,13 @@ class NetflixETL:
 
                 session.flush()
 
-                # Movies
+                # Movies (row_hash 與 bulk 載入相同)
+                hashes = movie_rows(self.df, {name: type.id for name, type in types.items()})['row_hash']
                 movies = []
-                for _, row in self.df.iterrows():
+                for (_, row), hash_value in zip(self.df.iterrows(), hashes):
                     movie = Movie(
                         imdb_id=row['imdbId'],
+                        row_hash=int(hash_value),
                         title=row['title'],
                         type_id=types[row['type']].id,
                         release_year=row['releaseYear'],
@@ -226,8 +329,110 @@ class NetflixETL:
                 logging.error('Fail to transform data.')
                 raise
 
+    def resolve_keys(self, chunk):
+        """在寫入端寫入本 chunk 的維度資料並配置 title id，回傳 build_tables 需要的外鍵對照表"""
+        with self.db_manager.get_db_session() as session:
+            keys = {'type_ids': self._load_dimension(session, Type.type, Type.id, chunk['type'].dropna().unique())}
+            if self.mode in ('normalized', 'bitmask'):
+                # 預先配置 title id，橋接表以整數鍵關聯；管線中尚未寫入的 chunk 也已配置，因此以計數器遞增
+                if self.next_title_id is None:
+                    self.next_title_id = (session.scalar(select(func.max(Title.id))) or 0) + 1
+                keys['first_title_id'] = self.next_title_id
+                self.next_title_id += len(chunk)
+            if self.mode == 'normalized':
+                keys['genre_ids'] = self._load_dimension(session, Genre.name, Genre.id, GENRES)
+                keys['country_ids'] = self._load_dimension(session, Country.code, Country.id, COUNTRIES)
+        return keys
+
+    def write_tables(self, tables):
+        """單一寫入者：依序寫入 build_tables 的結果，每個 chunk 在自己的 session 內 commit"""
+        with self.db_manager.get_db_session() as session:
+
+            try:
+                if self.incremental:
+                    movies = tables[Movie.__tablename__]
+                    changed = self._changed_rows(session, movies, Movie.imdb_id, Movie.row_hash)
+                    self._insert_batches(session, Movie.__table__, changed, conflict_key='imdb_id')
+                    logging.info(f'Upserted {len(changed)} new or changed rows, skipped {len(movies) - len(changed)} unchanged rows')
+                else:
+                    for name, frame in tables.items():
+                        self._insert_batches(session, Base.metadata.tables[name], frame)
+            except Exception as e:
+                logging.error(f'Fail to load {self.mode} data.')
+                raise
+        # 第一個資料表 (movies / titles) 每一行對應一筆 CSV 資料
+        self._count_rows(len(next(iter(tables.values()))))
+
+    def _changed_rows(self, session, frame, key_column, hash_column):
+        # 只查詢本批次的鍵值，成本隨批次大小而非資料表大小成長
+        keys = frame[key_column.key].tolist()
+        existing = []
+        for start in range(0, len(keys), 900):
+            batch = keys[start:start + 900]
+            existing += session.execute(select(key_column, hash_column).where(key_column.in_(batch))).all()
+        existing = pd.DataFrame(existing, columns=[key_column.key, 'existing_hash'])
+
+        merged = frame[[key_column.key, 'row_hash']].merge(existing, how='left', on=key_column.key)
+        return frame[(merged['row_hash'] != merged['existing_hash']).to_numpy()]
+
+    def _load_dimension(self, session, key_column, id_column, values):
+        ids = dict(session.execute(select(key_column, id_column)).all())
+        missing = [value for value in values if value not in ids]
+        if missing:
+            session.execute(key_column.table.insert(), [{key_column.key: value} for value in missing])
+            ids = dict(session.execute(select(key_column, id_column)).all())
+        return ids
+
+    def _insert_batches(self, session, table, frame, conflict_key=None):
+        # NA -> None 一次向量化轉換，再以 executemany 分批寫入
+        frame = frame.astype(object).where(frame.notna(), None)
+        columns = ', '.join(f'"{column}"' for column in frame.columns)
+        placeholders = ', '.join('?' * len(frame.columns))
+        sql = f'INSERT INTO {table.name} ({columns}) VALUES ({placeholders})'
+        if conflict_key is not None:
+            # upsert：鍵值已存在時僅在 row_hash 不同才更新
+            updates = ', '.join(f'"{column}" = excluded."{column}"' for column in frame.columns if column != conflict_key)
+            sql += (f' ON CONFLICT ("{conflict_key}") DO UPDATE SET {updates}'
+                    f' WHERE {table.name}.row_hash IS NOT excluded.row_hash')
+
+        rows = list(map(tuple, frame.to_numpy().tolist()))
+        connection = session.connection()
+        for start in range(0, len(rows), self.batch_size):
+            connection.exec_driver_sql(sql, rows[start:start + self.batch_size])
+
+    def _count_rows(self, rows):
+        self.rows_processed += rows
+        if self.chunksize is not None:
+            logging.info(f'Committed chunk of {rows} rows ({self.rows_processed} total)')
+
     def process(self):
-        self.transform_data()
+        start = time.perf_counter()
+        self.rows_processed = 0
+        self.next_title_id = None
+        with self.db_manager.bulk_load(self.load_profile):
+            if self.mode == 'orm':
+                for chunk in self.iter_chunks():
+                    # 每個 chunk 在自己的 session 內寫入並 commit，之後才讀取下一塊
+                    self.df = chunk
+                    self.transform_data()
+                    self._count_rows(len(chunk))
+            else:
+                # 子行程轉換 chunk，主行程是唯一的寫入者；整份讀取時只有一個 chunk，不建立行程池
+                workers = self.workers if self.chunksize is not None else 1
+                stage = 'incremental' if self.incremental else self.mode
+                logging.info(f'Start {stage} load from csv to SQLite with {workers} worker(s)...')
+                tasks = ((chunk, stage, self.resolve_keys(chunk)) for chunk in self.iter_chunks())
+                run_pipeline(tasks, build_tables, self.write_tables, workers)
+            self.db_manager.finalize_database()
+        elapsed = time.perf_counter() - start
+        logging.info(f'{self.mode} load: {self.rows_processed} rows in {elapsed:.2f}s ({self.rows_processed / elapsed:,.0f} rows/sec)')
+
+    def iter_chunks(self):
+        if self.chunksize is None:
+            yield self.df
+            return
+        yield from raw_cache.read_csv(self.csv_path, chunksize=self.chunksize, cache_dir=self.raw_cache_dir,
+                                      **self.read_options)
 
 def main():
     etl = NetflixETL("./data/netflix_processed.csv")
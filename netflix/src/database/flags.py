@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, and_, or_, true
+from .models import Title, GENRES, COUNTRIES
+
+# SQLite INTEGER 為有號 64 位元，保留符號位元避免負數
+MASK_WORD_BITS = 63
+COUNTRY_MASK_COLUMNS = [Title.country_mask_0, Title.country_mask_1, Title.country_mask_2]
+MATCH_MODES = ('any', 'all')
+
+def pack_flags(flags):
+    """(n, k) 的 bool 陣列打包成 (n, ceil(k / 63)) 的 int64 遮罩"""
+    words = -(-flags.shape[1] // MASK_WORD_BITS)
+    packed = np.zeros((flags.shape[0], words), dtype=np.int64)
+    for word in range(words):
+        bits = flags[:, word * MASK_WORD_BITS:(word + 1) * MASK_WORD_BITS].astype(np.int64)
+        packed[:, word] = bits @ (np.int64(1) << np.arange(bits.shape[1], dtype=np.int64))
+    return packed
+
+def genre_mask(names):
+    return _query_masks(names, GENRES)[0]
+
+def country_masks(codes):
+    return _query_masks(codes, COUNTRIES)
+
+def _query_masks(values, vocabulary):
+    masks = [0] * -(-len(vocabulary) // MASK_WORD_BITS)
+    for value in values:
+        if value not in vocabulary:
+            raise ValueError(f"Unknown flag: {value}")
+        word, bit = divmod(vocabulary.index(value), MASK_WORD_BITS)
+        masks[word] |= 1 << bit
+    return masks
+
+def _check_match(match):
+    if match not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode: {match}, expected one of {MATCH_MODES}")
+
+def flag_filter(genres=None, countries=None, match='any'):
+    """titles 的 WHERE 條件：包含任一 (any) 或全部 (all) 指定的類型 / 國家"""
+    _check_match(match)
+    conditions = []
+    if genres:
+        conditions.append(_mask_condition([Title.genre_mask], [genre_mask(genres)], match))
+    if countries:
+        conditions.append(_mask_condition(COUNTRY_MASK_COLUMNS, country_masks(countries), match))
+    # 未指定條件時不篩選；and_() 不帶參數在 SQLAlchemy 2.0 已棄用
+    return and_(*conditions) if conditions else true()
+
+def _mask_condition(columns, masks, match):
+    terms = []
+    for column, mask in zip(columns, masks):
+        if mask:
+            hits = column.op('&')(mask)
+            terms.append(hits != 0 if match == 'any' else hits == mask)
+    return or_(*terms) if match == 'any' else and_(*terms)
+
+class MovieFlagIndex:
+    """將 titles 的遮罩載入記憶體，以 NumPy 位元運算篩選"""
+
+    def __init__(self, imdb_ids, genre_masks, country_masks):
+        self.imdb_ids = np.asarray(imdb_ids)
+        self.genre_masks = np.asarray(genre_masks, dtype=np.int64).reshape(-1, 1)
+        self.country_masks = np.asarray(country_masks, dtype=np.int64)
+
+    @classmethod
+    def from_session(cls, session):
+        columns = [Title.imdb_id, Title.genre_mask, *COUNTRY_MASK_COLUMNS]
+        frame = pd.DataFrame(session.execute(select(*columns)).all(), columns=[c.key for c in columns])
+        masks = frame.drop(columns='imdb_id').fillna(0).astype(np.int64)
+        return cls(frame['imdb_id'], masks['genre_mask'], masks[[c.key for c in COUNTRY_MASK_COLUMNS]])
+
+    def filter(self, genres=None, countries=None, match='any'):
+        _check_match(match)
+        selected = np.ones(len(self.imdb_ids), dtype=bool)
+        if genres:
+            selected &= self._match(self.genre_masks, [genre_mask(genres)], match)
+        if countries:
+            selected &= self._match(self.country_masks, country_masks(countries), match)
+        return self.imdb_ids[selected]
+
+    @staticmethod
+    def _match(masks, query, match):
+        query = np.asarray(query, dtype=np.int64)
+        hits = masks & query
+        if match == 'any':
+            return (hits != 0).any(axis=1)
+        return (hits == query).all(axis=1)
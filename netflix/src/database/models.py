@@ -1,14 +1,41 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, Time, ForeignKey, Boolean
+import keyword
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, Time, ForeignKey, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+# CSV 中的 one-hot 欄位 (電影類型 / 國家代碼)，順序與 Movie 的 Boolean 欄位一致
+GENRES = [
+    'Action', 'Adult', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime',
+    'Documentary', 'Drama', 'Family', 'Fantasy', 'Film-Noir', 'Game-Show', 'History',
+    'Horror', 'Music', 'Musical', 'Mystery', 'News', 'Reality-TV', 'Romance',
+    'Sci-Fi', 'Short', 'Sport', 'Talk-Show', 'Thriller', 'War', 'Western',
+]
+
+COUNTRIES = [
+    'AD', 'AE', 'AG', 'AL', 'AO', 'AR', 'AT', 'AU', 'AZ', 'BA', 'BB', 'BE', 'BG', 'BH',
+    'BM', 'BO', 'BR', 'BS', 'BY', 'BZ', 'CA', 'CH', 'CI', 'CL', 'CM', 'CO', 'CR', 'CU',
+    'CV', 'CY', 'CZ', 'DE', 'DK', 'DO', 'DZ', 'EC', 'EE', 'EG', 'ES', 'FI', 'FJ', 'FR',
+    'GB', 'GF', 'GG', 'GH', 'GI', 'GQ', 'GR', 'GT', 'HK', 'HN', 'HR', 'HU', 'ID', 'IE',
+    'IL', 'IN', 'IQ', 'IS', 'IT', 'JM', 'JO', 'JP', 'KE', 'KR', 'KW', 'LB', 'LC', 'LI',
+    'LT', 'LU', 'LV', 'LY', 'MA', 'MC', 'MD', 'ME', 'MG', 'MK', 'ML', 'MT', 'MU', 'MX',
+    'MY', 'MZ', 'NE', 'NG', 'NI', 'NL', 'NO', 'NZ', 'OM', 'PA', 'PE', 'PF', 'PH', 'PK',
+    'PL', 'PS', 'PT', 'PY', 'QA', 'RO', 'RS', 'SA', 'SC', 'SE', 'SG', 'SI', 'SK', 'SM',
+    'SN', 'SV', 'TC', 'TD', 'TH', 'TN', 'TR', 'TT', 'TW', 'TZ', 'UA', 'UG', 'US', 'UY',
+    'VE', 'YE', 'ZA', 'ZM', 'ZW',
+]
+
+def flag_column(name):
+    """CSV one-hot 欄位名稱 -> movies 資料表欄位名稱，例如 'Film-Noir' -> 'film_noir'、'IN' -> 'in_'"""
+    column = name.lower().replace('-', '_')
+    return f'{column}_' if keyword.iskeyword(column) else column
+
 class Type(Base):
     __tablename__ = 'types'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    type = Column(String, unique=True, nullable=False)
+    type = Column(String, unique=True, index=True, nullable=False)
 
 class Movie(Base):
     __tablename__ = 'movies'
@@ -21,6 +48,7 @@ class Movie(Base):
     release_year = Column(Integer)
     imdb_average_rating = Column(Float)
     imdb_num_votes = Column(Integer)
+    row_hash = Column(Integer)  # 增量載入時判斷資料是否變動
     
     # 電影類型 (Boolean)
     action = Column(Boolean, default=False)
@@ -186,4 +214,76 @@ class Movie(Base):
     zw = Column(Boolean, default=False)  # 辛巴威
 
     # 關聯
-    type_rel = relationship("Type")
\ No newline at end of file
+    type_rel = relationship("Type")
+
+# 正規化結構：基本資訊 + 類型/國家維度表，以橋接表取代 one-hot 欄位
+class Title(Base):
+    __tablename__ = 'titles'
+
+    id = Column(Integer, primary_key=True)
+    imdb_id = Column(String, unique=True, index=True, nullable=False)
+    title = Column(String, nullable=False)
+    type_id = Column(Integer, ForeignKey('types.id'))
+    release_year = Column(Integer)
+    imdb_average_rating = Column(Float)
+    imdb_num_votes = Column(Integer)
+
+    # 類型 / 國家的位元遮罩 (位元順序同 GENRES / COUNTRIES，每個整數使用 63 位元)
+    genre_mask = Column(Integer)
+    country_mask_0 = Column(Integer)
+    country_mask_1 = Column(Integer)
+    country_mask_2 = Column(Integer)
+
+    type_rel = relationship("Type")
+    genres = relationship("Genre", secondary="movie_genres", viewonly=True)
+    countries = relationship("Country", secondary="movie_countries", viewonly=True)
+
+class Genre(Base):
+    __tablename__ = 'genres'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+
+class Country(Base):
+    __tablename__ = 'countries'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    code = Column(String, unique=True, index=True, nullable=False)
+
+class MovieGenre(Base):
+    __tablename__ = 'movie_genres'
+    __table_args__ = (
+        Index('ix_movie_genres_genre_id', 'genre_id', 'title_id'),
+        {'sqlite_with_rowid': False},
+    )
+
+    title_id = Column(Integer, ForeignKey('titles.id'), primary_key=True)
+    genre_id = Column(Integer, ForeignKey('genres.id'), primary_key=True)
+
+class MovieCountry(Base):
+    __tablename__ = 'movie_countries'
+    __table_args__ = (
+        Index('ix_movie_countries_country_id', 'country_id', 'title_id'),
+        {'sqlite_with_rowid': False},
+    )
+
+    title_id = Column(Integer, ForeignKey('titles.id'), primary_key=True)
+    country_id = Column(Integer, ForeignKey('countries.id'), primary_key=True)
+
+MOVIES_WIDE_VIEW = 'movies_wide'
+
+def movies_wide_view_sql():
+    """相容 view：由位元遮罩還原 movies 的寬表欄位 (normalized 與 bitmask 模式都會寫入遮罩)"""
+    flags = [
+        f"(t.genre_mask >> {bit}) & 1 AS \"{flag_column(name)}\""
+        for bit, name in enumerate(GENRES)
+    ] + [
+        f"(t.country_mask_{index // 63} >> {index % 63}) & 1 AS \"{flag_column(code)}\""
+        for index, code in enumerate(COUNTRIES)
+    ]
+    return (
+        f"CREATE VIEW IF NOT EXISTS {MOVIES_WIDE_VIEW} AS SELECT "
+        "t.imdb_id, t.title, t.type_id, t.release_year, t.imdb_average_rating, t.imdb_num_votes, "
+        + ", ".join(flags)
+        + " FROM titles t"
+    )
@@ -1,19 +1,125 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
 from .models import Base
 
+# SQLite 連線設定：bulk_load 供重建資料表的 ETL 大量寫入時使用，incremental_load 供寫入既有資料的載入使用，
+# serve 為載入完成後的安全設定
+PRAGMA_PROFILES = {
+    'bulk_load': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,  # 負值單位為 KiB，約 256 MB
+        'temp_store': 'MEMORY',
+        'mmap_size': 268435456
+    },
+    # 寫入保留的既有資料時維持 synchronous=NORMAL，斷電或系統當機時不會損毀既有資料
+    'incremental_load': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -262144,
+        'temp_store': 'MEMORY',
+        'mmap_size': 268435456
+    },
+    'serve': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY'
+    }
+}
+
 class DatabaseConnection:
-    def __init__(self, database_url="sqlite:///supermarket.db"):
+    def __init__(self, database_url="sqlite:///supermarket.db", profile='serve'):
         self.engine = create_engine(database_url)
+        self.profile = profile
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', self._apply_profile)
         self.SessionLocal = sessionmaker(bind=self.engine)
     
     def get_session(self):
         """提供基本的 session 創建"""
         return self.SessionLocal()
+
+    def _apply_profile(self, dbapi_connection, connection_record):
+        """每條新連線建立時套用目前的 PRAGMA 設定"""
+        cursor = dbapi_connection.cursor()
+        for name, value in PRAGMA_PROFILES[self.profile].items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    def use_profile(self, profile):
+        """切換連線設定，連線池中的舊連線會被釋放並以新設定重新連線"""
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"未知的連線設定: {profile}，可用設定: {list(PRAGMA_PROFILES)}")
+        self.profile = profile
+        self.engine.dispose()
+        if profile == 'serve' and self.engine.dialect.name == 'sqlite':
+            # synchronous=OFF 寫入的 WAL 在此以正常同步模式 checkpoint 回主檔
+            with self.engine.connect() as connection:
+                connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
     
-    def _create_tables(self):
-        """私有方法：創建資料表"""
-        Base.metadata.create_all(self.engine)
+    def _create_tables(self, deferred_indexes=False):
+        """私有方法：創建資料表，deferred_indexes=True 時延後建立索引"""
+        if not deferred_indexes:
+            Base.metadata.create_all(self.engine)
+        else:
+            # 只建立資料表，索引 (含 unique) 留待載入完成後由 _create_indexes 建立
+            with self.engine.begin() as connection:
+                for table in Base.metadata.sorted_tables:
+                    connection.execute(CreateTable(table, if_not_exists=True))
+        # 既有資料庫的資料表不會被重建，補上新增的欄位；延後建立索引時索引留給載入完成後處理
+        self._migrate_tables(create_indexes=not deferred_indexes)
+
+    def _migrate_tables(self, create_indexes=True):
+        """私有方法：create_all 只會建立不存在的資料表，既有資料庫由此補上新版模型新增的欄位與索引；
+        無法以 ALTER TABLE 補齊的差異 (欄位型別不同、NOT NULL 欄位、unique 索引遇到重複值) 則要求重置資料庫"""
+        with self.engine.begin() as connection:
+            inspector = inspect(connection)
+            # 先檢查全部欄位再修改，不相容時不留下只遷移一半的資料表
+            problems, missing = [], []
+            for table in Base.metadata.sorted_tables:
+                existing = {column['name']: column for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    column_type = column.type.compile(dialect=connection.dialect)
+                    if column.name not in existing:
+                        if column.nullable:
+                            missing.append((table.name, column.name, column_type))
+                        else:
+                            problems.append(f"{table.name}.{column.name} 缺少且不可為 NULL")
+                        continue
+                    existing_type = existing[column.name]['type'].compile(dialect=connection.dialect)
+                    if existing_type != column_type:
+                        problems.append(f"{table.name}.{column.name} 型別為 {existing_type}，新版為 {column_type}")
+            if not problems:
+                for table_name, column_name, column_type in missing:
+                    connection.exec_driver_sql(f'ALTER TABLE "{table_name}" ADD COLUMN "{column_name}" {column_type}')
+            if not problems and create_indexes:
+                for table in Base.metadata.sorted_tables:
+                    indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+                    for index in table.indexes:
+                        if index.name in indexes:
+                            continue
+                        try:
+                            index.create(connection)
+                        except IntegrityError:
+                            problems.append(f"{table.name} 有重複資料，無法建立 unique 索引 {index.name}")
+            if problems:
+                raise RuntimeError(f"既有資料庫的結構與新版不相容 ({'; '.join(problems)})，請以重置模式 (incremental=False) 重新載入")
+
+    def _create_indexes(self):
+        """私有方法：載入完成後建立延後的索引並更新統計資訊"""
+        created = False
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(connection)
+                        created = True
+            # 沒有延後建立的索引時 (增量載入) 改用 PRAGMA optimize，只重新分析統計資訊過時的資料表，
+            # 成本不隨整個資料庫成長
+            connection.exec_driver_sql("ANALYZE" if created else "PRAGMA optimize")
     
     def _delete_tables(self):
         """私有方法：刪除資料表"""
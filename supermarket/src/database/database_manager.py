@@ -5,20 +5,27 @@ class DatabaseManager:
     def __init__(self):
         self.db = DatabaseConnection()
     
-    def initialize_database(self):
+    def initialize_database(self, deferred_indexes=False):
         """初始化資料庫"""
         try:
-            self.db._create_tables()
+            self.db._create_tables(deferred_indexes)
         except Exception as e:
             raise Exception(f"初始化資料庫失敗：{str(e)}")
     
-    def reset_database(self):
+    def reset_database(self, deferred_indexes=False):
         """重置資料庫"""
         try:
             self.db._delete_tables()
-            self.db._create_tables()
+            self.db._create_tables(deferred_indexes)
         except Exception as e:
             raise Exception(f"重置資料庫失敗：{str(e)}")
+
+    def finalize_database(self):
+        """載入完成後建立延後的索引並更新統計資訊 (ANALYZE 或 PRAGMA optimize)"""
+        try:
+            self.db._create_indexes()
+        except Exception as e:
+            raise Exception(f"建立索引失敗：{str(e)}")
     
     @contextmanager
     def get_db_session(self):
@@ -33,6 +40,15 @@ class DatabaseManager:
         finally:
             session.close()
     
+    @contextmanager
+    def bulk_load(self, profile='bulk_load'):
+        """大量寫入期間切換為 bulk_load 連線設定，結束後切回 serve"""
+        self.db.use_profile(profile)
+        try:
+            yield
+        finally:
+            self.db.use_profile('serve')
+
     def execute_transaction(self, operation):
         """執行資料庫交易"""
         with self.get_db_session() as session:
@@ -1,8 +1,12 @@
 import logging
+import time
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from src.supermarket.database.models import Branch, ProductLine, Product, Sale
-from src.supermarket.database.database_manager import DatabaseManager
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import Branch, ProductLine, Product, Sale
+from .database_manager import DatabaseManager
+from .common import raw_cache, run_pipeline
 
 # 設定基本的 logging 配置
 logging.basicConfig(
@@ -11,135 +15,253 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# ETL 實際用到的 CSV 欄位；gross margin percentage 等未使用的欄位不解析
+CSV_COLUMNS = ['Invoice ID', 'Branch', 'City', 'Product line', 'Unit price', 'Quantity', 'Tax 5%', 'Total', 'Date',
+               'Time', 'Payment', 'cogs', 'gross income', 'Rating']
+
+def row_hash(frame):
+    """每列內容的 64 位元雜湊，增量載入時用來略過未變動的資料"""
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+def prepare_chunk(df):
+    """解析 Date 與 Time 欄位，回傳新的 DataFrame (不修改傳入的 chunk)"""
+    df = df.copy(deep=False)
+    df['Date'] = pd.to_datetime(df['Date'])
+    return pre_process_csv(df)
+
+def pre_process_csv(df):
+    logging.info("開始前處理 CSV 資料")
+    try:
+        # 轉換時間格式 (向量化)，無法解析的值為 None，由 process() 跨 chunk 彙總後只記錄一次
+        parsed = pd.to_datetime(df['Time'], format='%H:%M', errors='coerce')
+        invalid = parsed.isna()
+
+        # 合併 Date 與 Time 為單一時間戳記，時間無法解析時為 NULL
+        df['sold_at'] = df['Date'] + (parsed - parsed.dt.normalize())
+        # 明確建立 object 欄位：整個 chunk 都無法解析時 .where 會回傳 NaT 的 datetime 欄位，無法寫入 Time
+        df['Time'] = pd.Series(np.where(invalid, None, parsed.dt.time), index=df.index, dtype=object)
+        logging.info("CSV 資料前處理完成")
+        return df
+
+    except Exception as e:
+        logging.error(f"前處理失敗: {str(e)}")
+        raise
+
+def build_sales(chunk, keys):
+    """前處理 chunk 並以寫入端 resolve_keys 產生的 keys 對應外鍵，回傳可直接寫入 sales 的 DataFrame，
+    以及時間無法解析的筆數與範例值
+
+    不存取資料庫，由管線在子行程中執行。
+    """
+    df = prepare_chunk(chunk)
+    invalid_time = df['Time'].isna()
+    invalid_sample = chunk.loc[invalid_time, 'Time'].drop_duplicates().head(5).tolist()
+    branch_ids, product_line_ids, product_ids = keys
+    # 以向量化 map / merge 將外鍵對回每筆 Sales
+    product_keys = pd.DataFrame({
+        'product_line_id': df['Product line'].map(product_line_ids.set_index('name')['id']),
+        'unit_price': df['Unit price']
+    })
+    sales = pd.DataFrame({
+        'invoice_id': df['Invoice ID'],
+        'branch_id': df['Branch'].map(branch_ids.set_index('branch_code')['id']),
+        'product_id': product_keys.merge(product_ids, how='left', on=['product_line_id', 'unit_price'])['id'].to_numpy(),
+        'quantity': df['Quantity'],
+        'tax': df['Tax 5%'],
+        'total': df['Total'],
+        'date': df['Date'],
+        'time': df['Time'],  # 現在這裡的 Time 已經是 time 物件了
+        'sold_at': df['sold_at'].astype(object).where(df['sold_at'].notna(), None),
+        'payment_method': df['Payment'],
+        'cogs': df['cogs'],
+        'gross_income': df['gross income'],
+        'rating': df['Rating']
+    })
+    sales['row_hash'] = row_hash(sales)
+    return sales, (int(invalid_time.sum()), invalid_sample)
+
 class SuperMarketETL:
-    def __init__(self, csv_path):
+    def __init__(self, csv_path, chunksize=None, batch_size=10000, incremental=False, load_profile=None, defer_indexes=True,
+                 raw_cache_dir=raw_cache.CACHE_DIR, engine='pyarrow', workers=1):
         logging.info(f"開始初始化 ETL 處理，CSV 路徑: {csv_path}")
+        self.batch_size = batch_size
+        self.incremental = incremental
+        # synchronous=OFF 的 bulk_load 只用於重建資料表；增量載入寫入保留的既有資料，改用 incremental_load
+        self.load_profile = load_profile or ('incremental_load' if incremental else 'bulk_load')
+        self.csv_path = csv_path
+        self.chunksize = chunksize
+        # 串流模式下平行前處理 chunk 的子行程數，1 表示在主行程依序處理
+        self.workers = workers
+        # CSV 轉存的 Parquet 快取目錄，None 時每次都解析 CSV
+        self.raw_cache_dir = raw_cache_dir
+        self.read_options = dict(
+            usecols=CSV_COLUMNS,
+            dtype = {
+                'Invoice ID': str, 
+                'Branch': 'category', 
+                'City': 'category', 
+                'Product line': 'category', 
+                'Unit price': float, 
+                'Quantity': int, 
+                'Tax 5%': float, 
+                'Total': float, 
+                'Time': str, 
+                'Payment': 'category', 
+                'cogs': float, 
+                'gross income': float,
+                'Rating': float
+            }
+        )
+        # pyarrow 引擎以多執行緒解析整份檔案，但不支援 chunksize，串流模式沿用 C 引擎
+        if engine == 'pyarrow' and chunksize is None:
+            self.read_options['engine'] = 'pyarrow'
+        else:
+            # C 引擎預設的浮點數解析不一定取最接近的值，改用 round_trip 與 pyarrow 一致，
+            # 整份與串流讀取的數值 (與 row_hash) 才會相同
+            self.read_options['low_memory'] = False
+            self.read_options['float_precision'] = 'round_trip'
+        self.df = None
+        self.rows_processed = 0
+        # 各 chunk 時間無法解析的筆數與範例值，process() 結束時彙總記錄一次
+        self.invalid_time_count = 0
+        self.invalid_time_sample = []
+        # 維度資料表的鍵值與 id 對照表，第一次使用時讀取整張表，之後只加入新寫入的資料
+        self.dimension_ids = {}
         try:
-            self.df = pd.read_csv(
-                csv_path,
-                low_memory=False,
-                dtype = {
-                    'Invoice ID': str, 
-                    'Branch': str, 
-                    'City': str, 
-                    'Product line': str, 
-                    'Unit price': float, 
-                    'Quantity': int, 
-                    'Tax 5%': float, 
-                    'Total': float, 
-                    'Time': str, 
-                    'Payment': str, 
-                    'cogs': float, 
-                    'gross income': float,
-                    'Rating': float
-                }
-            )
-            logging.info(f"成功載入 CSV 檔案，共 {len(self.df)} 筆資料")
-            
-            self.df['Date'] = pd.to_datetime(self.df['Date'])
-            self.pre_process_csv()
+            # 串流模式下延後到 process() 才逐塊讀取；前處理一律在 process() 中進行
+            if chunksize is None:
+                start = time.perf_counter()
+                self.df = raw_cache.read_csv(csv_path, cache_dir=raw_cache_dir, **self.read_options)
+                memory = self.df.memory_usage(deep=True).sum() / 2**20
+                logging.info(f"成功載入 CSV 檔案，共 {len(self.df)} 筆資料，耗時 {time.perf_counter() - start:.2f} 秒 ({memory:.1f} MB)")
+
+            # 增量模式保留既有資料，以 invoice_id upsert (依賴 unique 索引，不延後建立)
             self.db_manager = DatabaseManager()
-            self.db_manager.reset_database()
+            if incremental:
+                self.db_manager.initialize_database()
+            else:
+                self.db_manager.reset_database(deferred_indexes=defer_indexes)
             
         except Exception as e:
             logging.error(f"初始化失敗: {str(e)}")
             raise
 
-    def pre_process_csv(self):
-        logging.info("開始前處理 CSV 資料")
-        try:
-            # 移除不需要的欄位
-            self.df.drop('gross margin percentage', axis=1, inplace=True)
-            
-            # 轉換時間格式
-            def convert_time_str(time_str):
-                try:
-                    return datetime.strptime(time_str, '%H:%M').time()
-                except ValueError:
-                    logging.warning(f"時間格式轉換失敗: {time_str}")
-                    return None
-            
-            self.df['Time'] = self.df['Time'].apply(convert_time_str)
-            logging.info("CSV 資料前處理完成")
-            
-        except Exception as e:
-            logging.error(f"前處理失敗: {str(e)}")
-            raise
+    def iter_chunks(self):
+        """逐塊讀取 CSV；未設定 chunksize 時直接回傳整份資料"""
+        if self.chunksize is None:
+            yield self.df
+            return
+        yield from raw_cache.read_csv(self.csv_path, chunksize=self.chunksize, cache_dir=self.raw_cache_dir,
+                                      **self.read_options)
 
-    def transform_data(self):
+    def resolve_keys(self, chunk):
+        """在寫入端寫入本 chunk 的主表與 Product 資料，回傳 build_sales 需要的外鍵對照表"""
         logging.info("開始轉換資料")
+        with self.db_manager.get_db_session() as session:
+            # 第一階段：以 drop_duplicates 取得主表數據 (串流模式下略過已寫入的資料)
+            branches = chunk[['Branch', 'City']].drop_duplicates('Branch')
+            branch_ids = self._load_dimension(
+                session, Branch,
+                branches.rename(columns={'Branch': 'branch_code', 'City': 'city'}),
+                ['branch_code']
+            )
+
+            product_lines = chunk[['Product line']].drop_duplicates()
+            product_line_ids = self._load_dimension(
+                session, ProductLine,
+                product_lines.rename(columns={'Product line': 'name'}),
+                ['name']
+            )
+
+            # 第二階段：處理 Product，以 (product_line_id, unit_price) 為鍵
+            product_keys = pd.DataFrame({
+                'product_line_id': chunk['Product line'].map(product_line_ids.set_index('name')['id']),
+                'unit_price': chunk['Unit price']
+            })
+            product_ids = self._load_dimension(
+                session, Product,
+                product_keys.drop_duplicates(),
+                ['product_line_id', 'unit_price']
+            )
+        return branch_ids, product_line_ids, product_ids
+
+    def write_sales(self, result):
+        """單一寫入者：第三階段整批寫入 build_sales 的結果，每個 chunk 在自己的 session 內 commit"""
+        sales, (invalid_count, invalid_sample) = result
+        self.invalid_time_count += invalid_count
+        for value in invalid_sample:
+            if len(self.invalid_time_sample) < 5 and value not in self.invalid_time_sample:
+                self.invalid_time_sample.append(value)
         with self.db_manager.get_db_session() as session:
             try:
-                # 第一階段：先創建和提交主表數據
-                branches = {}
-                product_lines = {}
-                products = {}
-                
-                # 先處理 Branch 和 ProductLine
-                for _, row in self.df.iterrows():
-                    # Branch
-                    if row['Branch'] not in branches:
-                        branch = Branch(
-                            branch_code=row['Branch'],
-                            city=row['City']
-                        )
-                        session.add(branch)
-                        branches[row['Branch']] = branch
-
-                    # ProductLine
-                    if row['Product line'] not in product_lines:
-                        product_line = ProductLine(
-                            name=row['Product line']
-                        )
-                        session.add(product_line)
-                        product_lines[row['Product line']] = product_line
-                
-                # 提交以獲取 ID
-                session.flush()  # 使用 flush 而不是 commit，保持在同一個事務中
-
-                # 第二階段：處理 Product
-                for _, row in self.df.iterrows():
-                    product_key = f"{row['Product line']}_{row['Unit price']}"
-                    if product_key not in products:
-                        product = Product(
-                            unit_price=row['Unit price'],
-                            product_line_id=product_lines[row['Product line']].id
-                        )
-                        session.add(product)
-                        products[product_key] = product
-                
-                session.flush()
-
-                # 第三階段：處理 Sales
-                sales = []
-                for _, row in self.df.iterrows():
-                    product_key = f"{row['Product line']}_{row['Unit price']}"
-                    sale = Sale(
-                        invoice_id=row['Invoice ID'],
-                        branch_id=branches[row['Branch']].id,
-                        product_id=products[product_key].id,
-                        quantity=row['Quantity'],
-                        tax=row['Tax 5%'],
-                        total=row['Total'],
-                        date=row['Date'],
-                        time=row['Time'],  # 現在這裡的 Time 已經是 time 物件了
-                        payment_method=row['Payment'],
-                        cogs=row['cogs'],
-                        gross_income=row['gross income'],
-                        rating=row['Rating']
-                    )
-                    sales.append(sale)
-
-                # 批量插入 sales 數據
-                session.bulk_save_objects(sales)
+                if self.incremental:
+                    self._upsert_sales(session, sales)
+                else:
+                    records = sales.to_dict('records')
+                    for start in range(0, len(records), self.batch_size):
+                        session.execute(Sale.__table__.insert(), records[start:start + self.batch_size])
                 # commit 會在 context manager 結束時自動執行
 
             except Exception as e:
                 logging.error(f"轉換資料失敗: {str(e)}")
                 raise
+        self.rows_processed += len(sales)
+        if self.chunksize is not None:
+            logging.info(f"已寫入 {len(sales)} 筆資料 (累計 {self.rows_processed} 筆)")
+
+    def _upsert_sales(self, session, sales):
+        # 只比對本批次的 invoice_id，略過 row_hash 未變動的資料
+        invoice_ids = sales['invoice_id'].tolist()
+        existing = []
+        for start in range(0, len(invoice_ids), 900):
+            batch = invoice_ids[start:start + 900]
+            existing += session.execute(
+                select(Sale.invoice_id, Sale.row_hash).where(Sale.invoice_id.in_(batch))
+            ).all()
+        existing = pd.DataFrame(existing, columns=['invoice_id', 'existing_hash'])
+        merged = sales[['invoice_id', 'row_hash']].merge(existing, how='left', on='invoice_id')
+        changed = sales[(merged['row_hash'] != merged['existing_hash']).to_numpy()]
+
+        statement = sqlite_insert(Sale.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['invoice_id'],
+            set_={column: statement.excluded[column] for column in changed.columns if column != 'invoice_id'},
+            where=Sale.row_hash.is_distinct_from(statement.excluded.row_hash)
+        )
+        records = changed.to_dict('records')
+        for start in range(0, len(records), self.batch_size):
+            session.execute(statement, records[start:start + self.batch_size])
+        logging.info(f"upsert {len(changed)} 筆新增或變動的資料，略過 {len(sales) - len(changed)} 筆未變動資料")
+
+    def _load_dimension(self, session, model, frame, keys):
+        """寫入資料庫中尚未存在的維度資料，回傳鍵值與 id 的對照表"""
+        columns = [model.id] + [getattr(model, key) for key in keys]
+        existing = self.dimension_ids.get(model)
+        if existing is None:
+            existing = pd.DataFrame(session.execute(select(*columns)).all(), columns=['id'] + keys)
+        new_rows = frame.merge(existing, how='left', on=keys, indicator=True)
+        new_rows = new_rows.loc[new_rows['_merge'] == 'left_only', frame.columns]
+        if not new_rows.empty:
+            # 主行程是唯一的寫入者，新寫入資料的 id 都大於對照表中最大的 id，只查詢這些資料
+            last_id = int(existing['id'].max()) if len(existing) else 0
+            session.execute(model.__table__.insert(), new_rows.to_dict('records'))
+            added = pd.DataFrame(session.execute(select(*columns).where(model.id > last_id)).all(), columns=['id'] + keys)
+            existing = added if existing.empty else pd.concat([existing, added], ignore_index=True)
+        self.dimension_ids[model] = existing
+        return existing
 
     def process(self):
-        self.transform_data()
+        self.rows_processed = 0
+        self.invalid_time_count = 0
+        self.invalid_time_sample = []
+        # 子行程前處理 chunk，主行程是唯一的寫入者；整份讀取時只有一個 chunk，不建立行程池
+        workers = self.workers if self.chunksize is not None else 1
+        with self.db_manager.bulk_load(self.load_profile):
+            tasks = ((chunk, self.resolve_keys(chunk)) for chunk in self.iter_chunks())
+            run_pipeline(tasks, build_sales, self.write_sales, workers)
+            self.db_manager.finalize_database()
+        if self.invalid_time_count:
+            logging.warning(f"時間格式轉換失敗 {self.invalid_time_count} 筆，範例: {self.invalid_time_sample}")
 
 def main():
     supermarket_etl = SuperMarketETL("./data/raw/supermarket_sales.csv")
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, Time, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, Time, DateTime, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -8,7 +8,7 @@ class Branch(Base):
     __tablename__ = 'branches'
     
     id = Column(Integer, primary_key=True)
-    branch_code = Column(String, unique=True, nullable=False)
+    branch_code = Column(String, unique=True, index=True, nullable=False)
     city = Column(String, nullable=False)
     
     sales = relationship("Sale", back_populates="branch")
@@ -17,7 +17,7 @@ class ProductLine(Base):
     __tablename__ = 'product_lines'
     
     id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True, nullable=False)
+    name = Column(String, unique=True, index=True, nullable=False)
     
     products = relationship("Product", back_populates="product_line")
 
@@ -35,18 +35,20 @@ class Sale(Base):
     __tablename__ = 'sales'
     
     id = Column(Integer, primary_key=True)
-    invoice_id = Column(String, unique=True, nullable=False)
-    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=False)
+    invoice_id = Column(String, unique=True, index=True, nullable=False)
+    branch_id = Column(Integer, ForeignKey('branches.id'), index=True, nullable=False)
     product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
     quantity = Column(Integer, nullable=False)
     date = Column(Date, nullable=False)
     time = Column(Time)
+    sold_at = Column(DateTime, index=True)  # Date + Time，供時間區間查詢
     payment_method = Column(String)
     total = Column(Float, nullable=False)
     tax = Column(Float)
     cogs = Column(Float)
     gross_income = Column(Float)
     rating = Column(Float)
+    row_hash = Column(Integer)  # 增量載入時判斷資料是否變動
     
     branch = relationship("Branch", back_populates="sales")
     product = relationship("Product", back_populates="sales")
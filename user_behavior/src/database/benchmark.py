@@ -0,0 +1,77 @@
+"""比較 UserBehaviorETL 的 orm 與 batch 載入模式
+
+用法 (於 user_behavior 目錄下執行):
+    python -m src.database.benchmark --rows 1000000 --modes orm batch
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from .etl import UserBehaviorETL
+
+DEVICES = {
+    'Google Pixel 5': 'Android',
+    'OnePlus 9': 'Android',
+    'Samsung Galaxy S21': 'Android',
+    'Xiaomi Mi 11': 'Android',
+    'iPhone 12': 'iOS'
+}
+
+# 產生資料時每次寫入的列數，大量資料也不需一次放進記憶體
+BLOCK_ROWS = 200_000
+
+def generate_frame(rng, start, rows):
+    """第 start 筆起 rows 筆與 user_behavior_dataset.csv 相同欄位的合成資料 (etl_benchmark.py 也使用)"""
+    devices = rng.choice(list(DEVICES), rows)
+    return pd.DataFrame({
+        'User ID': np.arange(start + 1, start + rows + 1),
+        'Device Model': devices,
+        'Operating System': pd.Series(devices).map(DEVICES),
+        'App Usage Time (min/day)': rng.integers(30, 600, rows),
+        'Screen On Time (hours/day)': rng.uniform(1, 12, rows).round(1),
+        'Battery Drain (mAh/day)': rng.integers(300, 3000, rows),
+        'Number of Apps Installed': rng.integers(10, 100, rows),
+        'Data Usage (MB/day)': rng.integers(100, 2500, rows),
+        'Age': rng.integers(18, 60, rows),
+        'Gender': rng.choice(['Male', 'Female'], rows),
+        'User Behavior Class': rng.integers(1, 6, rows)
+    })
+
+def generate_dataset(csv_path, rows, seed=0):
+    """產生與 user_behavior_dataset.csv 相同欄位的合成資料"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, BLOCK_ROWS):
+        frame = generate_frame(rng, start, min(BLOCK_ROWS, rows - start))
+        frame.to_csv(csv_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+def time_mode(csv_path, mode):
+    etl = UserBehaviorETL(csv_path, mode=mode)
+    start = time.perf_counter()
+    etl.process()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='UserBehaviorETL 載入模式計時比較')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--modes', nargs='+', default=['orm', 'batch'])
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # 在暫存目錄執行，避免覆寫既有的 user_behavior.db
+        os.chdir(workdir)
+        try:
+            csv_path = os.path.join(workdir, 'user_behavior_synthetic.csv')
+            generate_dataset(csv_path, args.rows)
+            results = {mode: time_mode(csv_path, mode) for mode in args.modes}
+        finally:
+            os.chdir(cwd)
+
+    print(f"\n=== {args.rows:,} 筆合成資料 ===")
+    for mode, elapsed in results.items():
+        print(f"{mode:>6}: {elapsed:8.2f}s ({args.rows / elapsed:,.0f} rows/sec)")
+
+if __name__ == "__main__":
+    main()
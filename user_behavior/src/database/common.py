@@ -0,0 +1,13 @@
+"""repo 根目錄 etl_common 套件中的共用模組
+
+專案以自己的目錄為工作目錄執行 (notebook、etl_orchestrator)，repo 根目錄不在 sys.path 上，在此加入後匯入。
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+from etl_common import raw_cache  # noqa: E402
+from etl_common.pipeline import run_pipeline  # noqa: E402
@@ -1,47 +1,120 @@
 import logging
+import time
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from .models import User, Device, OS, UserBehavior
 from .database_manager import DatabaseManager
+from .common import raw_cache, run_pipeline
 
 logging.basicConfig(
     level=logging.INFO
 )
 
+LOAD_MODES = ('orm', 'batch')
+
+# CSV 欄位 -> user_behaviors 資料表欄位
+BEHAVIOR_COLUMNS = {
+    'User ID': 'user_id',
+    'App Usage Time (min/day)': 'app_usage_time',
+    'Screen On Time (hours/day)': 'screen_on_time',
+    'Battery Drain (mAh/day)': 'battery_drain',
+    'Number of Apps Installed': 'num_apps_installed',
+    'Data Usage (MB/day)': 'data_usage',
+    'User Behavior Class': 'behavior_class'
+}
+
+# ETL 實際用到的 CSV 欄位 (BEHAVIOR_COLUMNS 已包含 User ID)
+CSV_COLUMNS = ['Device Model', 'Operating System', 'Age', 'Gender', *BEHAVIOR_COLUMNS]
+
+def row_hash(frame):
+    """每列內容的 64 位元雜湊，增量載入時用來略過未變動的資料"""
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+def build_rows(chunk, device_ids, os_ids):
+    """以寫入端解析好的裝置與作業系統 id 建立 users / user_behaviors 的 DataFrame
+
+    不存取資料庫，由管線在子行程中執行。
+    """
+    # user_id 直接沿用 CSV 的 User ID，不需 flush 取得主鍵
+    users = pd.DataFrame({
+        'user_id': chunk['User ID'],
+        'age': chunk['Age'],
+        'gender': chunk['Gender']
+    })
+    behaviors = chunk[list(BEHAVIOR_COLUMNS)].rename(columns=BEHAVIOR_COLUMNS)
+    behaviors['device_id'] = chunk['Device Model'].map(device_ids)
+    behaviors['os_id'] = chunk['Operating System'].map(os_ids)
+    users['row_hash'] = row_hash(pd.concat([users, behaviors.drop(columns='user_id')], axis=1))
+    return users, behaviors
+
 class UserBehaviorETL:
-    def __init__(self, csv_path):
+    def __init__(self, csv_path, chunksize=None, mode='orm', batch_size=10000, incremental=False, load_profile=None, defer_indexes=True,
+                 raw_cache_dir=raw_cache.CACHE_DIR, engine='pyarrow', workers=1):
         logging.info(f"開始 ETL，CSV 路徑: {csv_path}")
-        try:
-            self.df = pd.read_csv(
-                csv_path,
-                low_memory=False,
-                dtype={
-                    'User ID': int,
-                    'Device Model': str,
-                    'Operating System': str,
-                    'App Usage Time (min/day)': float,
-                    'Screen On Time (hours/day)': float,
-                    'Battery Drain (mAh/day)': float,
-                    'Number of Apps Installed': int,
-                    'Data Usage (MB/day)': float,
-                    'Age': int,
-                    'Gender': str,
-                    'User Behavior Class': int
-                }
-            )
-            logging.info(f"已載入 {len(self.df)} 筆資料")
-        except Exception as e:
-            logging.error(f'CSV 載入失敗: {e}')
+        if mode not in LOAD_MODES:
+            raise ValueError(f"未知的載入模式: {mode}，可用模式: {LOAD_MODES}")
+        if incremental and mode != 'batch':
+            raise ValueError("增量載入以批次 upsert 寫入，需搭配 mode='batch'")
+        self.mode = mode
+        self.incremental = incremental
+        # synchronous=OFF 的 bulk_load 只用於重建資料表；增量載入寫入保留的既有資料，改用 incremental_load
+        self.load_profile = load_profile or ('incremental_load' if incremental else 'bulk_load')
+        self.batch_size = batch_size
+        self.csv_path = csv_path
+        self.chunksize = chunksize
+        # batch 模式串流載入時平行轉換 chunk 的子行程數，1 表示在主行程依序轉換
+        self.workers = workers
+        # CSV 轉存的 Parquet 快取目錄，None 時每次都解析 CSV
+        self.raw_cache_dir = raw_cache_dir
+        self.read_options = dict(
+            usecols=CSV_COLUMNS,
+            dtype={
+                'User ID': int,
+                'Device Model': 'category',
+                'Operating System': 'category',
+                'App Usage Time (min/day)': float,
+                'Screen On Time (hours/day)': float,
+                'Battery Drain (mAh/day)': float,
+                'Number of Apps Installed': int,
+                'Data Usage (MB/day)': float,
+                'Age': int,
+                'Gender': 'category',
+                'User Behavior Class': int
+            }
+        )
+        # pyarrow 引擎以多執行緒解析整份檔案，但不支援 chunksize，串流模式沿用 C 引擎
+        if engine == 'pyarrow' and chunksize is None:
+            self.read_options['engine'] = 'pyarrow'
+        else:
+            # C 引擎預設的浮點數解析不一定取最接近的值，改用 round_trip 與 pyarrow 一致，
+            # 整份與串流讀取的數值 (與 row_hash) 才會相同
+            self.read_options['low_memory'] = False
+            self.read_options['float_precision'] = 'round_trip'
+        self.df = None
+        self.rows_processed = 0
+
+        # 串流模式下延後到 process() 才逐塊讀取
+        if chunksize is None:
+            try:
+                start = time.perf_counter()
+                self.df = raw_cache.read_csv(csv_path, cache_dir=raw_cache_dir, **self.read_options)
+                memory = self.df.memory_usage(deep=True).sum() / 2**20
+                logging.info(f"已載入 {len(self.df)} 筆資料，耗時 {time.perf_counter() - start:.2f} 秒 ({memory:.1f} MB)")
+            except Exception as e:
+                logging.error(f'CSV 載入失敗: {e}')
 
         self.db_manager = DatabaseManager()
-        self.db_manager.initialize_database()
+        # 增量載入的 upsert 依賴 unique 索引，只有整批重建時才延後建立索引
+        self.db_manager.initialize_database(reset=not incremental, deferred_indexes=defer_indexes and not incremental)
     
     def transform_data(self):
         logging.info('開始將 CSV 資料轉換到 SQLite...')
         with self.db_manager.get_db_session() as session:
-            # 建立裝置和作業系統的對照表
-            device_dict = {}
-            os_dict = {}
+            # 建立裝置和作業系統的對照表 (串流模式下沿用先前 chunk 已寫入的資料)
+            device_dict = {d.device_model: d.device_id for d in session.query(Device).all()}
+            os_dict = {o.operating_system: o.os_id for o in session.query(OS).all()}
             
             # 逐行處理資料
             for _, row in self.df.iterrows():
@@ -92,8 +165,93 @@ class UserBehaviorETL:
                 logging.error(f'資料轉換失敗: {e}')
                 raise
 
+    def resolve_keys(self, chunk):
+        """在寫入端寫入本 chunk 的裝置與作業系統，回傳 build_rows 需要的 id 對照表"""
+        with self.db_manager.get_db_session() as session:
+            # 維度表先一次解析完成，每個維度只 flush 一次
+            device_dict = self._resolve_dimension(session, Device, 'device_model', 'device_id', chunk['Device Model'].unique())
+            os_dict = self._resolve_dimension(session, OS, 'operating_system', 'os_id', chunk['Operating System'].unique())
+        return device_dict, os_dict
+
+    def write_rows(self, rows):
+        """單一寫入者：寫入 build_rows 的結果，每個 chunk 在自己的 session 內 commit"""
+        users, behaviors = rows
+        with self.db_manager.get_db_session() as session:
+            try:
+                user_insert = User.__table__.insert()
+                behavior_insert = UserBehavior.__table__.insert()
+                if self.incremental:
+                    users, behaviors = self._changed_users(session, users, behaviors)
+                    user_insert = self._upsert_statement(User.__table__, 'user_id', users.columns)
+                    behavior_insert = self._upsert_statement(UserBehavior.__table__, 'user_id', behaviors.columns)
+
+                for start in range(0, len(users), self.batch_size):
+                    end = start + self.batch_size
+                    session.execute(user_insert, users.iloc[start:end].to_dict('records'))
+                    session.execute(behavior_insert, behaviors.iloc[start:end].to_dict('records'))
+                logging.info('資料轉換完成')
+            except Exception as e:
+                logging.error(f'資料轉換失敗: {e}')
+                raise
+        self._count_rows(len(rows[0]))
+
+    def _changed_users(self, session, users, behaviors):
+        # 只比對本批次的 user_id，略過 row_hash 未變動的使用者
+        user_ids = users['user_id'].tolist()
+        existing = []
+        for start in range(0, len(user_ids), 900):
+            batch = user_ids[start:start + 900]
+            existing += session.execute(select(User.user_id, User.row_hash).where(User.user_id.in_(batch))).all()
+        existing = pd.DataFrame(existing, columns=['user_id', 'existing_hash'])
+        merged = users[['user_id', 'row_hash']].merge(existing, how='left', on='user_id')
+        changed = (merged['row_hash'] != merged['existing_hash']).to_numpy()
+        logging.info(f'upsert {changed.sum()} 筆新增或變動的資料，略過 {len(users) - changed.sum()} 筆未變動資料')
+        return users[changed], behaviors[changed]
+
+    def _upsert_statement(self, table, key, columns):
+        statement = sqlite_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={column: statement.excluded[column] for column in columns if column != key}
+        )
+
+    def _resolve_dimension(self, session, model, name_column, id_column, values):
+        ids = {getattr(row, name_column): getattr(row, id_column) for row in session.query(model).all()}
+        new_rows = [model(**{name_column: value}) for value in values if value not in ids]
+        if new_rows:
+            session.add_all(new_rows)
+            session.flush()
+            ids.update({getattr(row, name_column): getattr(row, id_column) for row in new_rows})
+        return ids
+
+    def _count_rows(self, rows):
+        self.rows_processed += rows
+        if self.chunksize is not None:
+            logging.info(f'已寫入 {rows} 筆資料 (累計 {self.rows_processed} 筆)')
+
     def process(self):
-        self.transform_data()
+        self.rows_processed = 0
+        with self.db_manager.bulk_load(self.load_profile):
+            if self.mode == 'orm':
+                for chunk in self.iter_chunks():
+                    # 每個 chunk 在自己的 session 內寫入並 commit，之後才讀取下一塊
+                    self.df = chunk
+                    self.transform_data()
+                    self._count_rows(len(chunk))
+            else:
+                # 子行程轉換 chunk，主行程是唯一的寫入者；整份讀取時只有一個 chunk，不建立行程池
+                workers = self.workers if self.chunksize is not None else 1
+                logging.info('開始以批次模式將 CSV 資料轉換到 SQLite...')
+                tasks = ((chunk, *self.resolve_keys(chunk)) for chunk in self.iter_chunks())
+                run_pipeline(tasks, build_rows, self.write_rows, workers)
+            self.db_manager.finalize_database()
+
+    def iter_chunks(self):
+        if self.chunksize is None:
+            yield self.df
+            return
+        yield from raw_cache.read_csv(self.csv_path, chunksize=self.chunksize, cache_dir=self.raw_cache_dir,
+                                      **self.read_options)
 
 def main():
     etl = UserBehaviorETL("./data/user_behavior_dataset.csv")
@@ -10,6 +10,7 @@ class User(Base):
     user_id = Column(Integer, primary_key=True, autoincrement=True)
     age = Column(Integer, nullable=False)
     gender = Column(String, nullable=False)
+    row_hash = Column(Integer)  # 整列 CSV 資料的雜湊，增量載入時判斷資料是否變動
     behavior_data = relationship("UserBehavior", back_populates="user")
 
 class Device(Base):
@@ -30,8 +31,8 @@ class UserBehavior(Base):
     __tablename__ = 'user_behaviors'
 
     behavior_id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
-    device_id = Column(Integer, ForeignKey('devices.device_id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.user_id'), unique=True, index=True, nullable=False)
+    device_id = Column(Integer, ForeignKey('devices.device_id'), index=True, nullable=False)
     os_id = Column(Integer, ForeignKey('os.os_id'), nullable=False)
     
     app_usage_time = Column(Float, nullable=False)